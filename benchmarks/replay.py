@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Measure opening, seeking and replaying a recording.
+# Without a recording file, a deterministic one is generated:
+# some tunnels, with a few restarts, recorded every second for some hours.
+#
+# Usage: python3 benchmarks/replay.py [FILE]
+#
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tunnelmon.core import TunnelsParser, AutoTunnel, Connection
+from tunnelmon.record import Recorder, Recording, ReplayParser
+
+TUNNELS = 50
+HOURS = 24
+
+
+def generate(filename, tunnels=TUNNELS, hours=HOURS):
+    rng = random.Random(42)
+    tp = TunnelsParser()
+    recorder = Recorder(filename)
+    start = 1700000000.0
+    for i in range(tunnels):
+        t = AutoTunnel(1000 + i, 2000 + i, 10000 + i, "via%i" % i, "target%i" % i, 22, 'L')
+        t.connections.append(Connection('127.0.0.1', 10000 + i, None, None, 'LISTEN', 2))
+        tp.tunnels[1000 + i] = t
+    for s in range(hours * 3600):
+        tp.timestamp = start + s
+        for t in tp.tunnels.values():
+            t.uptime = (t.uptime or 0) + 1
+        if rng.random() < 0.01:
+            t = tp.tunnels[1000 + rng.randrange(tunnels)]
+            t.ssh_pid += tunnels
+            t.uptime = 0
+            t.restarts += 1
+        recorder.record(tp)
+    recorder.close()
+
+
+def timed(name, func, count=1):
+    start = time.perf_counter()
+    for i in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    print("%-28s %10.3f ms" % (name, 1000 * elapsed / count))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        fd, filename = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        print("Generating %i tunnels for %i hours in %s" % (TUNNELS, HOURS, filename))
+        generate(filename)
+    print("Size: %.1f MB" % (os.path.getsize(filename) / 1e6))
+
+    timed("open (index keyframes)", lambda: Recording(filename).close(), 10)
+
+    recording = Recording(filename)
+    replay = ReplayParser(recording)
+    rng = random.Random(0)
+    length = recording.end - recording.start
+    timed("random seek", lambda: replay.seek(recording.start + rng.random() * length), 1000)
+
+    def one_hour():
+        replay.seek(recording.start)
+        replay.paused = True
+        for s in range(3600):
+            replay.position = recording.start + s
+            replay.update()
+    timed("replay 3600 updates", one_hour)
+
+    recording.close()
+    if len(sys.argv) <= 1:
+        os.unlink(filename)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Measure the wall-clock time of one-shot tunnelmon runs,
+# as done by health checks calling it every few seconds.
+#
+# Usage: python3 benchmarks/startup.py [RUNS]
+#
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("python startup", ["-c", "pass"]),
+    ("import tunnelmon", ["-c", "import tunnelmon"]),
+    ("tunnelmon -u", ["-m", "tunnelmon", "-u"]),
+    ("tunnelmon -n", ["-m", "tunnelmon", "-n"]),
+    ("tunnelmon -u -l error", ["-m", "tunnelmon", "-u", "-l", "error"]),
+    ("tunnelmon", ["-m", "tunnelmon"]),
+]
+
+
+def measure(args, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("%-24s %10s %10s %10s" % ("CASE", "MIN(ms)", "MEDIAN(ms)", "MAX(ms)"))
+    for name, args in CASES:
+        times = measure(args, runs)
+        print("%-24s %10.1f %10.1f %10.1f" % (
+            name, 1000 * min(times), 1000 * statistics.median(times), 1000 * max(times)))
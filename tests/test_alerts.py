@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import types
+import unittest
+
+from tunnelmon.alerts import AlertsEngine, Condition, Hook, Rule, tunnels_keys
+from tunnelmon.core import AutoTunnel, RawTunnel
+
+
+class StubHook(Hook):
+    """Remember the alerts instead of doing anything."""
+    kind = 'stub'
+
+    def __init__(self):
+        super().__init__('stub')
+        self.alerts = []
+
+    def __call__(self, alert):
+        self.alerts.append((alert.rule.name, alert.tunnel.ssh_pid, alert.timestamp))
+
+
+def parser(*tunnels):
+    return types.SimpleNamespace(tunnels={t.ssh_pid: t for t in tunnels})
+
+
+def tunnel(ssh_pid, health='ok', in_port=8080):
+    t = RawTunnel(ssh_pid, in_port, 'bastion', 'db', 5432, 'L')
+    t.health = health
+    return t
+
+
+class TestCheck(unittest.TestCase):
+
+    def fired(self, condition, states, delay=0, repeat=0):
+        """Check the states, a list of (time, parser), return the alerts."""
+        hook = StubHook()
+        engine = AlertsEngine([Rule('rule', Condition(condition), [hook], delay, repeat)])
+        for now, tp in states:
+            engine.check(tp, now=now)
+        # Wait for the hooks.
+        engine.close()
+        return hook.alerts
+
+    def test_fire_once(self):
+        bad = parser(tunnel(200, 'unbound'))
+        alerts = self.fired('healthy == 0', [(0, bad), (1, bad), (2, bad)])
+        self.assertEqual(alerts, [('rule', 200, 0)])
+
+    def test_not_holding(self):
+        good = parser(tunnel(200))
+        self.assertEqual(self.fired('healthy == 0', [(0, good), (1, good)]), [])
+
+    def test_delay(self):
+        bad = parser(tunnel(200, 'unbound'))
+        alerts = self.fired('healthy == 0', [(0, bad), (5, bad), (9, bad), (10, bad), (11, bad)], delay=10)
+        self.assertEqual(alerts, [('rule', 200, 10)])
+
+    def test_delay_reset(self):
+        # The condition must hold for the whole delay.
+        bad, good = parser(tunnel(200, 'unbound')), parser(tunnel(200))
+        alerts = self.fired('healthy == 0', [(0, bad), (5, good), (12, bad), (20, bad), (22, bad)], delay=10)
+        self.assertEqual(alerts, [('rule', 200, 22)])
+
+    def test_repeat(self):
+        bad = parser(tunnel(200, 'unbound'))
+        alerts = self.fired('healthy == 0', [(t, bad) for t in range(0, 70, 10)], repeat=30)
+        self.assertEqual([a[2] for a in alerts], [0, 30, 60])
+
+    def test_fire_again(self):
+        # Once the condition stopped holding, it fires again.
+        bad, good = parser(tunnel(200, 'unbound')), parser(tunnel(200))
+        alerts = self.fired('healthy == 0', [(0, bad), (1, good), (2, bad)])
+        self.assertEqual([a[2] for a in alerts], [0, 2])
+
+    def test_gone(self):
+        tp, empty = parser(tunnel(200)), parser()
+        alerts = self.fired('gone', [(0, tp), (1, empty), (2, empty)])
+        self.assertEqual(alerts, [('rule', 200, 1)])
+
+    def test_back(self):
+        # A tunnel that came back is not gone anymore.
+        tp, empty = parser(tunnel(200)), parser()
+        alerts = self.fired('gone', [(0, tp), (1, empty), (2, tp), (3, empty)])
+        self.assertEqual([a[2] for a in alerts], [1, 3])
+
+    def test_respawned(self):
+        # The ssh process of an autossh tunnel is another one, but it is the same tunnel.
+        def auto(ssh_pid, health):
+            t = AutoTunnel(100, ssh_pid, 8080, 'bastion', 'db', 5432, 'L')
+            t.health = health
+            return t
+        alerts = self.fired('healthy == 0', [(0, parser(auto(200, 'unbound'))), (1, parser(auto(201, 'unbound')))])
+        self.assertEqual(alerts, [('rule', 200, 0)])
+
+    def test_same_spec(self):
+        # A second ssh that failed to bind the port of the first one.
+        tp = parser(tunnel(200), tunnel(300, 'unbound'))
+        alerts = self.fired('healthy == 0', [(0, tp), (1, tp)])
+        self.assertEqual(alerts, [('rule', 300, 0)])
+
+
+class TestKeys(unittest.TestCase):
+
+    def test_ordinals(self):
+        a, b, c = tunnel(300), tunnel(200), tunnel(250, in_port=9090)
+        keys = tunnels_keys([a, b, c])
+        self.assertEqual(len(keys), 3)
+        # Ordered by PID, whatever the order of the tunnels.
+        self.assertEqual(keys, tunnels_keys([c, b, a]))
+        self.assertIs(keys[(None, 'local', 8080, 'bastion', 'db', 5432, 0)], b)
+        self.assertIs(keys[(None, 'local', 8080, 'bastion', 'db', 5432, 1)], a)
+        self.assertIs(keys[(None, 'local', 9090, 'bastion', 'db', 5432, 0)], c)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import unittest
+
+from tunnelmon.core import AutoTunnel, SshChild, TunnelsParser, optional_columns
+
+
+def tunnel(ssh_pid, autossh_pid=100):
+    return AutoTunnel(autossh_pid, ssh_pid, 8080, 'bastion', 'db', 5432, 'L')
+
+
+class TestTrack(unittest.TestCase):
+
+    def setUp(self):
+        self.tp = TunnelsParser()
+
+    def track(self, ssh_pid, ssh_ctime, now, autossh_ctime=10.0):
+        t = tunnel(ssh_pid)
+        self.tp.track(t, 100, autossh_ctime, ssh_ctime, now)
+        return t
+
+    def test_first_seen(self):
+        t = self.track(200, 20.0, 30.0)
+        self.assertEqual((t.restarts, t.last_restart, t.flaps), (0, None, 0))
+
+    def test_same_ssh(self):
+        self.track(200, 20.0, 30.0)
+        t = self.track(200, 20.0, 31.0)
+        self.assertEqual(t.restarts, 0)
+
+    def test_respawn(self):
+        self.track(200, 20.0, 30.0)
+        t = self.track(201, 40.0, 45.0)
+        self.assertEqual((t.restarts, t.last_restart, t.flaps), (1, 5.0, 1))
+
+    def test_recycled_ssh_pid(self):
+        # Same PID, but another process.
+        self.track(200, 20.0, 30.0)
+        t = self.track(200, 40.0, 45.0)
+        self.assertEqual(t.restarts, 1)
+
+    def test_recycled_autossh_pid(self):
+        # A new autossh process got the PID of an old one: its history starts over.
+        self.track(200, 20.0, 30.0)
+        self.track(201, 40.0, 45.0)
+        t = self.track(300, 60.0, 65.0, autossh_ctime=50.0)
+        self.assertEqual((t.restarts, t.last_restart, t.flaps), (0, None, 0))
+
+    def test_flap_window(self):
+        self.tp.flap_window = 100
+        self.track(200, 0.0, 1.0)
+        self.track(201, 10.0, 11.0)
+        self.track(202, 50.0, 51.0)
+        t = self.track(202, 50.0, 105.0)
+        self.assertEqual((t.restarts, t.flaps), (2, 2))
+        # The restart at 10 is out of the window.
+        t = self.track(202, 50.0, 115.0)
+        self.assertEqual((t.restarts, t.flaps), (2, 1))
+        t = self.track(202, 50.0, 155.0)
+        self.assertEqual((t.restarts, t.flaps), (2, 0))
+
+
+class TestSshChild(unittest.TestCase):
+
+    def test_bounded_flaps(self):
+        child = SshChild(10.0, 200, 20.0, max_flaps=3)
+        for i in range(10):
+            child.restarted(201 + i, 30.0 + i)
+        self.assertEqual(child.restarts, 10)
+        self.assertEqual(child.nb_flaps(40.0, 600), 3)
+
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.t = tunnel(200)
+        self.t.health = 'ok'
+        self.t.cpu = 1.25
+        self.t.rss = 3 * 1024 * 1024
+
+    def test_none(self):
+        tp = TunnelsParser(optional_columns())
+        self.assertNotIn('HEALTH', tp.header)
+        self.assertNotIn('CPU%', tp.header)
+        self.assertEqual(len(self.t.repr_tunnel(tp.columns).split('\t')), len(tp.header.split('\t')))
+
+    def test_health(self):
+        tp = TunnelsParser(optional_columns(health=True))
+        self.assertEqual(tp.header.split('\t')[-1], 'HEALTH')
+        self.assertEqual(self.t.repr_tunnel(tp.columns).split('\t')[-1], 'ok')
+
+    def test_resources(self):
+        tp = TunnelsParser(optional_columns(health=True, resources=True))
+        self.assertEqual(tp.header.split('\t')[-5:], ['HEALTH', 'CPU%', 'RSS', 'FDS', 'CTXSW'])
+        self.assertEqual(self.t.repr_tunnel(tp.columns).split('\t')[-5:], ['ok', '1.2', '3.0M', '-', '-'])
+
+
+if __name__ == '__main__':
+    unittest.main()
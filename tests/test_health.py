@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import socket
+import struct
+import threading
+import unittest
+from unittest import mock
+
+from tunnelmon.health import HealthChecker, probe
+
+
+class Server:
+    """A local TCP server doing something with the connections it accepts."""
+
+    def __init__(self, handle=None):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.address = self.sock.getsockname()
+        self.conns = []
+        if handle:
+            threading.Thread(target=self.serve, args=(handle,), daemon=True).start()
+
+    def serve(self, handle):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            handle(conn)
+
+    def close(self):
+        self.sock.close()
+        for conn in self.conns:
+            conn.close()
+
+
+def reset(conn):
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    conn.close()
+
+
+class TestProbe(unittest.TestCase):
+
+    def probe(self, handle):
+        server = Server(handle)
+        try:
+            return probe([server.address], timeout=0.3)[server.address]
+        finally:
+            server.close()
+
+    def test_kept_open(self):
+        self.assertTrue(self.probe(lambda conn: None))
+
+    def test_not_accepted(self):
+        # Still in the backlog: that is how a working ssh forward looks, until the target answers.
+        self.assertTrue(self.probe(None))
+
+    def test_talking(self):
+        self.assertTrue(self.probe(lambda conn: conn.sendall(b'SSH-2.0-OpenSSH\r\n')))
+
+    def test_closed(self):
+        # What ssh does when the channel cannot be opened.
+        self.assertFalse(self.probe(lambda conn: conn.close()))
+
+    def test_reset(self):
+        self.assertFalse(self.probe(reset))
+
+    def test_refused(self):
+        server = Server()
+        address = server.address
+        server.close()
+        self.assertFalse(probe([address], timeout=0.3)[address])
+
+
+class TestBackground(unittest.TestCase):
+
+    def test_interval(self):
+        checker = HealthChecker(probe=True, timeout=0.1, interval=60)
+        address = ('127.0.0.1', 8080)
+        with mock.patch('tunnelmon.health.probe', return_value={address: False}) as fake:
+            # Not probed yet.
+            self.assertEqual(checker.probe_background({address}), {})
+            checker.probing.result()
+            for i in range(5):
+                self.assertEqual(checker.probe_background({address}), {address: False})
+            self.assertEqual(fake.call_count, 1)
+
+            # The interval elapsed.
+            checker.probed -= 60
+            checker.probe_background({address})
+            checker.probing.result()
+            self.assertEqual(fake.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+from tunnelmon.core import RawTunnel
+from tunnelmon.netns import NetNamespaces, decode_address
+
+# Lines of /proc/net/tcp and /proc/net/tcp6, as written by a little endian host.
+TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 0100007F:1E61 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1001 1 0000000000000000 100 0 0 10 0
+   1: 0100007F:1E61 0100007F:8DDE 01 00000000:00000000 00:00000000 00000000     0        0 1002 1 0000000000000000 20 4 30 10 -1
+   2: 0501A8C0:C350 0A01A8C0:0016 08 00000000:00000000 00:00000000 00000000     0        0 1003 1 0000000000000000 20 4 30 10 -1
+"""
+TCP6 = """\
+  sl  local_address                         remote_address                        st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000001000000:0016 00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 2001 1 0000000000000000 100 0 0 10 0
+   1: B80D0120000000000000000001000000:1F90 0000000000000000FFFF00000100007F:9E49 01 00000000:00000000 00:00000000 00000000     0        0 2002 1 0000000000000000 20 4 30 10 -1
+"""
+
+
+@unittest.skipUnless(sys.byteorder == 'little', "samples of a little endian host")
+class TestDecodeAddress(unittest.TestCase):
+
+    def test_ipv4(self):
+        self.assertEqual(decode_address('0100007F:1E61', socket.AF_INET), ('127.0.0.1', 7777))
+        self.assertEqual(decode_address('0501A8C0:C350', socket.AF_INET), ('192.168.1.5', 50000))
+
+    def test_ipv6(self):
+        self.assertEqual(decode_address('00000000000000000000000001000000:0016', socket.AF_INET6), ('::1', 22))
+        self.assertEqual(decode_address('B80D0120000000000000000001000000:1F90', socket.AF_INET6),
+                         ('2001:db8::1', 8080))
+
+    def test_ipv4_mapped(self):
+        self.assertEqual(decode_address('0000000000000000FFFF00000100007F:9E49', socket.AF_INET6),
+                         ('::ffff:127.0.0.1', 40521))
+
+    def test_port_zero(self):
+        self.assertEqual(decode_address('00000000:0000', socket.AF_INET), (None, None))
+        self.assertEqual(decode_address('00000000000000000000000000000000:0000', socket.AF_INET6), (None, None))
+
+
+def fake_proc():
+    """A /proc/ tree with the process 42, holding sockets of the samples tables."""
+    proc = tempfile.TemporaryDirectory()
+    pid = os.path.join(proc.name, '42')
+    os.makedirs(os.path.join(pid, 'net'))
+    os.makedirs(os.path.join(pid, 'fd'))
+    with open(os.path.join(pid, 'net', 'tcp'), 'w') as fd:
+        fd.write(TCP)
+    with open(os.path.join(pid, 'net', 'tcp6'), 'w') as fd:
+        fd.write(TCP6)
+    for fd, target in (('10', 'socket:[1002]'), ('2', '/dev/null'), ('3', 'socket:[2001]'), ('4', 'pipe:[7]')):
+        os.symlink(target, os.path.join(pid, 'fd', fd))
+    return proc
+
+
+@unittest.skipUnless(sys.byteorder == 'little', "samples of a little endian host")
+class TestProc(unittest.TestCase):
+    """Read a fake /proc/<pid>/ tree."""
+
+    def setUp(self):
+        self.proc = fake_proc()
+        self.netns = NetNamespaces(self.proc.name)
+
+    def tearDown(self):
+        self.proc.cleanup()
+
+    def test_table(self):
+        table = self.netns.table(42)
+        self.assertEqual(table['1001'], (socket.AF_INET, '127.0.0.1', 7777, None, None, 'LISTEN'))
+        self.assertEqual(table['1002'], (socket.AF_INET, '127.0.0.1', 7777, '127.0.0.1', 36318, 'ESTABLISHED'))
+        self.assertEqual(table['1003'], (socket.AF_INET, '192.168.1.5', 50000, '192.168.1.10', 22, 'CLOSE_WAIT'))
+        self.assertEqual(table['2001'], (socket.AF_INET6, '::1', 22, None, None, 'LISTEN'))
+        self.assertEqual(table['2002'], (socket.AF_INET6, '2001:db8::1', 8080, '::ffff:127.0.0.1', 40521, 'ESTABLISHED'))
+
+    def test_no_ipv6(self):
+        os.remove(os.path.join(self.proc.name, '42', 'net', 'tcp6'))
+        self.assertEqual(sorted(self.netns.table(42)), ['1001', '1002', '1003'])
+
+    def test_sockets(self):
+        # In the order of the file descriptors.
+        self.assertEqual(self.netns.sockets(42), ['2001', '1002'])
+
+
+@unittest.skipUnless(sys.byteorder == 'little', "samples of a little endian host")
+class TestCollect(unittest.TestCase):
+    """Collect the tunnel of a process living in another namespace than Tunnelmon."""
+
+    def setUp(self):
+        self.proc = fake_proc()
+        for pid in ('self', '42'):
+            os.makedirs(os.path.join(self.proc.name, pid, 'ns'), exist_ok=True)
+            open(os.path.join(self.proc.name, pid, 'ns', 'net'), 'w').close()
+        self.netns = NetNamespaces(self.proc.name)
+        self.tunnel = RawTunnel(42, 7777, 'bastion', 'db', 80, 'L')
+        self.inode = self.netns.namespace(42)
+
+    def tearDown(self):
+        self.proc.cleanup()
+
+    def test_connections(self):
+        self.netns.collect({42: self.tunnel})
+        self.assertEqual(self.tunnel.namespace, "net:%i" % self.inode)
+        self.assertEqual([(c.in_port, c.status) for c in self.tunnel.connections],
+                         [(22, 'LISTEN'), (7777, 'ESTABLISHED')])
+        self.assertEqual(self.netns.listening, {"net:%i" % self.inode: {7777, 22}})
+
+    def test_without_connections(self):
+        # The tunnels list does not show connections, but the health check needs them.
+        self.netns.collect({42: self.tunnel}, connections=False)
+        self.assertEqual(len(self.tunnel.connections), 2)
+        self.assertEqual(self.netns.listening, {"net:%i" % self.inode: {7777, 22}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import os
+import socket
+import tempfile
+import types
+import unittest
+
+from tunnelmon.core import AutoTunnel, Connection, RawTunnel
+from tunnelmon.record import Recorder, Recording, ReplayParser
+
+
+def parser(t, *tunnels):
+    # Like TunnelsParser, autossh tunnels are keyed by the autossh PID.
+    return types.SimpleNamespace(timestamp=t, tunnels={getattr(tun, 'autossh_pid', tun.ssh_pid): tun for tun in tunnels})
+
+
+def raw(in_port, ssh_pid=200):
+    return RawTunnel(ssh_pid, in_port, 'bastion', 'db', 5432, 'L')
+
+
+class TestRecord(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def record(self, states, keyframe_interval=60):
+        recorder = Recorder(self.filename, keyframe_interval)
+        for tp in states:
+            recorder.record(tp)
+        recorder.close()
+
+    def replay(self, t):
+        """Return the tunnels { ssh_pid : Tunnel } of the recording at time t."""
+        recording = Recording(self.filename)
+        self.addCleanup(recording.close)
+        replay = ReplayParser(recording)
+        replay.paused = True
+        replay.seek(t)
+        replay.update()
+        return replay.tunnels
+
+    def lines(self):
+        with open(self.filename) as fd:
+            return fd.read().split('\n')
+
+    def test_round_trip(self):
+        auto = AutoTunnel(100, 201, 8080, 'bastion', 'db', 5432, 'L')
+        auto.uptime = 30
+        auto.restarts = 2
+        auto.last_restart = 10
+        auto.flaps = 1
+        auto.health = 'ok'
+        auto.connections.append(Connection('127.0.0.1', 8080, None, None, 'LISTEN', socket.AF_INET))
+        auto.connections.append(Connection('::1', 8080, '::1', 40000, 'ESTABLISHED', socket.AF_INET6))
+        self.record([parser(1000, auto, raw(9090))])
+
+        tunnels = self.replay(1000)
+        self.assertEqual(sorted(tunnels), [100, 200])
+        t = tunnels[100]
+        self.assertIs(type(t), AutoTunnel)
+        self.assertEqual((t.autossh_pid, t.ssh_pid, t.in_port, t.via_host, t.target_host, t.out_port, t.forward),
+                         (100, 201, 8080, 'bastion', 'db', 5432, 'local'))
+        self.assertEqual((t.uptime, t.restarts, t.last_restart, t.flaps, t.health), (30, 2, 10, 1, 'ok'))
+        self.assertEqual([repr(c) for c in t.connections], [repr(c) for c in auto.connections])
+        self.assertIs(type(tunnels[200]), RawTunnel)
+
+    def test_deltas(self):
+        # Only changes are written between keyframes.
+        self.record([parser(1000 + i, raw(8080)) for i in range(5)] + [parser(1005, raw(8081))])
+        self.assertEqual(len(self.lines()), 3)  # keyframe, delta and the final newline
+
+    def test_seek_in_deltas(self):
+        # Keyframes at 1000 and 1060, a tunnel appears at 1010, moves at 1020, goes away at 1030.
+        states = []
+        for t in range(1000, 1100, 10):
+            tunnels = []
+            if 1010 <= t < 1030:
+                tunnels.append(raw(8080 if t < 1020 else 8081, ssh_pid=300))
+            states.append(parser(t, raw(9000 + t - 1000), *tunnels))
+        self.record(states)
+
+        tunnels = self.replay(1015)
+        self.assertEqual(tunnels[200].in_port, 9010)
+        self.assertEqual(tunnels[300].in_port, 8080)
+        tunnels = self.replay(1025)
+        self.assertEqual(tunnels[200].in_port, 9020)
+        self.assertEqual(tunnels[300].in_port, 8081)
+        tunnels = self.replay(1035)
+        self.assertEqual(sorted(tunnels), [200])
+        tunnels = self.replay(1075)
+        self.assertEqual(tunnels[200].in_port, 9070)
+
+    def test_keyframes_index(self):
+        self.record([parser(t, raw(t)) for t in range(1000, 1200, 10)])
+        recording = Recording(self.filename)
+        self.addCleanup(recording.close)
+        self.assertEqual(recording.times, [1000, 1060, 1120, 1180])
+        self.assertEqual((recording.start, recording.end), (1000, 1190))
+        with open(self.filename, 'rb') as fd:
+            data = fd.read()
+        self.assertTrue(data[recording.keyframe(1119):].startswith(b'{"k":"f","t":1060'))
+        self.assertTrue(data[recording.keyframe(1120):].startswith(b'{"k":"f","t":1120'))
+
+    def test_unterminated_last_line(self):
+        self.record([parser(t, raw(t)) for t in range(1000, 1030, 10)])
+        with open(self.filename, 'a') as fd:
+            fd.write('{"k":"d","t":1030,"set":{"2')
+        recording = Recording(self.filename)
+        self.addCleanup(recording.close)
+        self.assertEqual(recording.end, 1020)
+        self.assertEqual(self.replay(1030)[200].in_port, 1020)
+
+    def test_append_after_truncated_line(self):
+        # A recorder died while writing, another one appended to the file later.
+        self.record([parser(t, raw(t)) for t in range(1000, 1100, 10)])
+        with open(self.filename, 'a') as fd:
+            fd.write('{"k":"d","t":1100,"set":{"200":{"ty')
+        self.record([parser(t, raw(t)) for t in range(1110, 1200, 10)])
+
+        lines = self.lines()
+        self.assertTrue(lines[-2].startswith('{"k":"d","t":1190'))
+        recording = Recording(self.filename)
+        self.addCleanup(recording.close)
+        self.assertEqual(recording.times, [1000, 1060, 1110, 1170])
+        self.assertEqual(recording.end, 1190)
+        self.assertEqual(self.replay(1095)[200].in_port, 1090)
+        self.assertEqual(self.replay(1130)[200].in_port, 1130)
+
+    def test_bad_line(self):
+        # A bad complete line is skipped, the playback goes on with the next deltas.
+        self.record([parser(t, raw(t)) for t in range(1000, 1060, 10)])
+        lines = self.lines()
+        lines.insert(3, '{"k":"d","t":1025,"set":{"2')
+        with open(self.filename, 'w') as fd:
+            fd.write('\n'.join(lines))
+        self.assertEqual(self.replay(1050)[200].in_port, 1050)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+
+import os
+import tempfile
+import unittest
+
+from tunnelmon.core import AutoTunnel
+from tunnelmon.resources import ResourceMeter
+
+
+def stat(utime, stime, starttime):
+    """A /proc/<pid>/stat line, with a command name that looks like the end of the line."""
+    # Fields from 3 (state) to 52 of proc(5).
+    fields = ['0'] * 50
+    fields[0] = 'S'
+    fields[11] = str(utime)
+    fields[12] = str(stime)
+    fields[19] = str(starttime)
+    return "42 (ssh) 1 2) %s\n" % " ".join(fields)
+
+
+class TestRead(unittest.TestCase):
+    """Read a fake /proc/<pid>/ tree."""
+
+    def setUp(self):
+        self.proc = tempfile.TemporaryDirectory()
+        self.pid = os.path.join(self.proc.name, '42')
+        os.makedirs(os.path.join(self.pid, 'fd'))
+        self.write('stat', stat(250, 50, 9999))
+        self.write('statm', "1000 250 100 10 0 200 0\n")
+        self.write('status', "Name:\tssh\nState:\tS (sleeping)\n"
+                             "voluntary_ctxt_switches:\t30\nnonvoluntary_ctxt_switches:\t12\n")
+        for fd in ('0', '1', '2', '3'):
+            os.symlink('/dev/null', os.path.join(self.pid, 'fd', fd))
+        self.meter = ResourceMeter(self.proc.name)
+        self.meter.clock_ticks = 100
+        self.meter.page_size = 4096
+
+    def tearDown(self):
+        self.proc.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.pid, name), 'w') as fd:
+            fd.write(content)
+
+    def test_read(self):
+        self.assertEqual(self.meter.read(42), (9999, 3.0, 250 * 4096, 4, 42))
+
+    def test_measure_since_start(self):
+        t = AutoTunnel(100, 42, 8080, 'bastion', 'db', 5432, 'L')
+        t.uptime = 30
+        self.meter.measure(type('Parser', (), {'tunnels': {42: t}}))
+        self.assertEqual((t.cpu, t.rss, t.fds, t.ctx_switches), (10.0, 250 * 4096, 4, 42))
+
+    def test_measure_since_previous(self):
+        t = AutoTunnel(100, 42, 8080, 'bastion', 'db', 5432, 'L')
+        t.uptime = 30
+        tp = type('Parser', (), {'tunnels': {42: t}})
+        self.meter.measure(tp)
+        # One more CPU second over the next measure.
+        self.write('stat', stat(300, 100, 9999))
+        start, cpu, when = self.meter.previous[42]
+        self.meter.previous[42] = (start, cpu, when - 10)
+        self.meter.measure(tp)
+        self.assertAlmostEqual(t.cpu, 10.0, delta=0.1)
+
+    def test_measure_other_process(self):
+        # Same PID, but another process: the previous measure does not apply.
+        t = AutoTunnel(100, 42, 8080, 'bastion', 'db', 5432, 'L')
+        t.uptime = 30
+        tp = type('Parser', (), {'tunnels': {42: t}})
+        self.meter.measure(tp)
+        self.write('stat', stat(600, 0, 12345))
+        self.meter.measure(tp)
+        self.assertEqual(t.cpu, 20.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
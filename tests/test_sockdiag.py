@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import socket
+import struct
+import unittest
+
+from tunnelmon.sockdiag import SockDiag, INET_DIAG_INFO
+
+# The samples are built field by field at the offsets of the kernel headers,
+# not with the structures of the module, so that a wrong layout shows up.
+
+# struct inet_diag_msg (linux/inet_diag.h), 72 bytes.
+MSG_SIZE = 72
+MSG_SPORT, MSG_DPORT, MSG_SRC, MSG_DST = 4, 6, 8, 24
+MSG_RQUEUE, MSG_WQUEUE, MSG_INODE = 56, 60, 68
+
+# struct tcp_info (linux/tcp.h): 8 bytes of flags, then 32 bits fields.
+TCPI_RTT_OFFSET = 8 + 15 * 4
+TCPI_RTTVAR_OFFSET = 8 + 16 * 4
+TCPI_TOTAL_RETRANS_OFFSET = 8 + 23 * 4
+TCPI_PACING_RATE_OFFSET = 104  # first 64 bits field
+TCPI_BYTES_ACKED_OFFSET = 120
+TCPI_BYTES_RECEIVED_OFFSET = 128
+
+
+def inet_diag_msg(family, src, sport, dst, dport, rqueue=0, wqueue=0):
+    msg = bytearray(MSG_SIZE)
+    msg[0] = family
+    msg[1] = 1  # TCP_ESTABLISHED
+    struct.pack_into(">H", msg, MSG_SPORT, sport)
+    struct.pack_into(">H", msg, MSG_DPORT, dport)
+    packed_src = socket.inet_pton(family, src)
+    packed_dst = socket.inet_pton(family, dst)
+    msg[MSG_SRC:MSG_SRC + len(packed_src)] = packed_src
+    msg[MSG_DST:MSG_DST + len(packed_dst)] = packed_dst
+    struct.pack_into("=I", msg, MSG_RQUEUE, rqueue)
+    struct.pack_into("=I", msg, MSG_WQUEUE, wqueue)
+    struct.pack_into("=I", msg, MSG_INODE, 12345)
+    return bytes(msg)
+
+
+def tcp_info(size, rtt, rttvar, retrans, acked=0, received=0):
+    info = bytearray(size)
+    struct.pack_into("=I", info, TCPI_RTT_OFFSET, rtt)
+    struct.pack_into("=I", info, TCPI_RTTVAR_OFFSET, rttvar)
+    struct.pack_into("=I", info, TCPI_TOTAL_RETRANS_OFFSET, retrans)
+    if size >= TCPI_BYTES_RECEIVED_OFFSET + 8:
+        struct.pack_into("=Q", info, TCPI_PACING_RATE_OFFSET, 2**40 + 1)
+        struct.pack_into("=Q", info, TCPI_BYTES_ACKED_OFFSET, acked)
+        struct.pack_into("=Q", info, TCPI_BYTES_RECEIVED_OFFSET, received)
+    return bytes(info)
+
+
+def rtattr(kind, payload):
+    attr = struct.pack("=HH", 4 + len(payload), kind) + payload
+    # Attributes are aligned on 4 bytes.
+    return attr + b'\0' * (-len(attr) % 4)
+
+
+class TestParse(unittest.TestCase):
+
+    def parse(self, data, addrlen, wanted):
+        stats = {}
+        SockDiag().parse(data, 0, len(data), addrlen, wanted, stats)
+        return stats
+
+    def test_ipv4(self):
+        key = ('127.0.0.1', 7777, '127.0.0.1', 36318)
+        data = inet_diag_msg(socket.AF_INET, '127.0.0.1', 7777, '127.0.0.1', 36318, rqueue=3, wqueue=5000)
+        data += rtattr(INET_DIAG_INFO, tcp_info(232, 1500, 750, 2, 2**33 + 7, 4096))
+        info = self.parse(data, 4, {key})[key]
+        self.assertEqual((info.rqueue, info.wqueue), (3, 5000))
+        self.assertEqual((info.rtt, info.rttvar, info.retrans), (1500, 750, 2))
+        self.assertEqual((info.bytes_acked, info.bytes_received), (2**33 + 7, 4096))
+
+    def test_ipv6(self):
+        key = ('2001:db8::1', 22, '::1', 50000)
+        data = inet_diag_msg(socket.AF_INET6, '2001:db8::1', 22, '::1', 50000)
+        data += rtattr(INET_DIAG_INFO, tcp_info(232, 20000, 10000, 0, 10, 20))
+        info = self.parse(data, 16, {key})[key]
+        self.assertEqual((info.rtt, info.rttvar, info.retrans), (20000, 10000, 0))
+        self.assertEqual((info.bytes_acked, info.bytes_received), (10, 20))
+
+    def test_unconnected(self):
+        # Listening sockets have a zero foreign address and port.
+        key = ('0.0.0.0', 1080, '0.0.0.0', 0)
+        data = inet_diag_msg(socket.AF_INET, '0.0.0.0', 1080, '0.0.0.0', 0)
+        data += rtattr(INET_DIAG_INFO, tcp_info(232, 0, 0, 0))
+        self.assertIn(key, self.parse(data, 4, {key}))
+
+    def test_old_kernel(self):
+        # Before Linux 4.1, tcp_info stops before the bytes counters.
+        key = ('127.0.0.1', 7777, '127.0.0.1', 36318)
+        data = inet_diag_msg(socket.AF_INET, '127.0.0.1', 7777, '127.0.0.1', 36318)
+        data += rtattr(INET_DIAG_INFO, tcp_info(104, 1500, 750, 2))
+        info = self.parse(data, 4, {key})[key]
+        self.assertEqual((info.rtt, info.retrans), (1500, 2))
+        self.assertIsNone(info.bytes_acked)
+        self.assertIsNone(info.bytes_received)
+
+    def test_other_attributes(self):
+        # Attributes other than INET_DIAG_INFO are skipped, whatever their length.
+        key = ('127.0.0.1', 7777, '127.0.0.1', 36318)
+        data = inet_diag_msg(socket.AF_INET, '127.0.0.1', 7777, '127.0.0.1', 36318)
+        data += rtattr(1, b'\1\2\3') + rtattr(INET_DIAG_INFO, tcp_info(232, 42, 21, 1))
+        self.assertEqual(self.parse(data, 4, {key})[key].rtt, 42)
+
+    def test_not_wanted(self):
+        data = inet_diag_msg(socket.AF_INET, '127.0.0.1', 7777, '127.0.0.1', 36318)
+        data += rtattr(INET_DIAG_INFO, tcp_info(232, 1500, 750, 2))
+        self.assertEqual(self.parse(data, 4, {('127.0.0.1', 7777, '127.0.0.1', 1)}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
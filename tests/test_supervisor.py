@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import asyncio
+import os
+import signal
+import tempfile
+import unittest
+from unittest import mock
+
+from tunnelmon.supervisor import SupervisedSsh
+
+# Like OpenSSH, catch SIGTERM, say so, and exit with 255.
+FAKE_SSH = """#!/bin/sh
+trap 'echo "Killed by signal 15." >&2; exit 255' TERM
+sleep 30 &
+wait
+"""
+
+
+def tunnel(**kwargs):
+    return SupervisedSsh('test', 'L', 8080, 'bastion', 'db', 5432, **kwargs)
+
+
+class TestDelay(unittest.TestCase):
+
+    def test_no_failure(self):
+        self.assertEqual(tunnel().delay(), 0)
+
+    def test_exponential(self):
+        t = tunnel(backoff_min=1, backoff_max=300)
+        with mock.patch('random.uniform', lambda a, b: b):
+            delays = []
+            for failures in range(1, 12):
+                t.failures = failures
+                delays.append(t.delay())
+        self.assertEqual(delays, [1, 2, 4, 8, 16, 32, 64, 128, 256, 300, 300])
+
+    def test_jitter(self):
+        t = tunnel(backoff_min=2)
+        t.failures = 3
+        with mock.patch('random.uniform', lambda a, b: a):
+            self.assertEqual(t.delay(), 4)
+        for i in range(100):
+            self.assertTrue(4 <= t.delay() <= 8)
+
+
+class TestExited(unittest.TestCase):
+
+    def setUp(self):
+        self.t = tunnel(backoff_min=1, stable=60)
+
+    def test_failures(self):
+        for i in range(1, 4):
+            self.t.exited(255, 1)
+            self.assertEqual(self.t.failures, i)
+
+    def test_stable(self):
+        # A failure after a long run starts the backoff over.
+        for i in range(3):
+            self.t.exited(255, 1)
+        self.t.exited(255, 60)
+        self.assertEqual(self.t.failures, 1)
+
+    def test_restarting(self):
+        for i in range(3):
+            self.t.exited(255, 1)
+        self.t.restarting = True
+        self.assertEqual(self.t.exited(255, 1), 0)
+        self.assertFalse(self.t.restarting)
+        # The next failure is a failure.
+        self.t.exited(255, 1)
+        self.assertEqual(self.t.failures, 1)
+
+    def test_terminated_by_signal(self):
+        self.t.exited(255, 1)
+        self.assertEqual(self.t.exited(-signal.SIGTERM, 1), 0)
+
+    def test_terminated_openssh(self):
+        self.t.exited(255, 1)
+        self.t.last_error = "Killed by signal 15."
+        self.assertEqual(self.t.exited(255, 1), 0)
+
+    def test_restart_not_running(self):
+        # Nothing to terminate, the next exit is not on purpose.
+        self.t.restart()
+        self.assertFalse(self.t.restarting)
+
+
+class TestRun(unittest.TestCase):
+    """Run a fake ssh, with a backoff long enough to be noticed."""
+
+    def setUp(self):
+        fd, self.ssh = tempfile.mkstemp()
+        os.write(fd, FAKE_SSH.encode())
+        os.close(fd)
+        os.chmod(self.ssh, 0o700)
+        self.t = tunnel(ssh=self.ssh, backoff_min=5, stable=60)
+
+    def tearDown(self):
+        os.remove(self.ssh)
+
+    async def started(self, previous=None, timeout=3):
+        """Wait for another ssh process to be running, return its PID."""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while loop.time() < end:
+            if self.t.process and self.t.process.pid != previous:
+                # Let the shell set its trap up.
+                await asyncio.sleep(0.1)
+                return self.t.process.pid
+            await asyncio.sleep(0.01)
+        self.fail("ssh not restarted within %is" % timeout)
+
+    def run_scenario(self, restart):
+        async def scenario():
+            task = asyncio.ensure_future(self.t.run())
+            pid = await self.started()
+            for i in range(4):
+                restart(pid)
+                pid = await self.started(pid, timeout=1)
+                self.assertEqual(self.t.failures, 0)
+            self.t.stop()
+            await asyncio.wait_for(task, 3)
+            self.assertEqual(self.t.restarts, 4)
+        asyncio.run(scenario())
+
+    def test_restart(self):
+        self.run_scenario(lambda pid: self.t.restart())
+
+    def test_external_sigterm(self):
+        # Like the R key of another Tunnelmon instance.
+        self.run_scenario(lambda pid: os.kill(pid, signal.SIGTERM))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# ALERTS
+#################################################################################################
+
+# Rules are read from sections of the configuration file named "alert:<name>", for example:
+#
+#   [alerts]
+#   workers = 2
+#   pending = 64
+#
+#   [alert:down]
+#   condition = established == 0
+#   delay = 10
+#   repeat = 300
+#   hooks = exec:notify-send "tunnel down"
+#           log:~/tunnelmon.alerts
+#           socket:/run/tunnelmon.sock
+#
+# A condition is either "gone" (the tunnel disappeared), or compares a field of the tunnel
+# (see FIELDS) to a number, with one of the OPERATORS.
+# The alert fires once the condition held for "delay" seconds (default: 0), then again every
+# "repeat" seconds while it holds (default: 0, never). Hooks are abandoned after "timeout" seconds
+# (default: 10).
+# Hooks are run by "workers" threads (default: 2), and no more than "pending" hooks
+# (default: 64) may wait for a thread, the others are dropped.
+
+import collections
+import concurrent.futures
+import logging
+import operator
+import os
+import re
+import shlex
+import socket
+import subprocess
+import threading
+import time
+
+from . import core
+from . import health
+from .core import AutoTunnel, SupervisedTunnel
+
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '>': operator.gt,
+}
+
+# Values of a tunnel that can be tested by a condition.
+FIELDS = {
+    'established': lambda t: sum(1 for c in t.connections if c.status == 'ESTABLISHED'),
+    'connections': lambda t: len(t.connections),
+    'restarts': lambda t: t.restarts,
+    'flaps': lambda t: t.flaps,
+    'uptime': lambda t: t.uptime or 0,
+    'healthy': lambda t: int(t.health in health.HEALTHY),
+    # Resources are only measured with --resources.
+    'cpu': lambda t: t.cpu or 0,
+    'rss': lambda t: (t.rss or 0) / 2**20,  # MiB
+    'fds': lambda t: t.fds or 0,
+}
+
+
+def tunnel_key(tunnel):
+    """What identifies a tunnel across refreshes, even if its processes are restarted."""
+    return (tunnel.namespace, tunnel.forward, tunnel.in_port, tunnel.via_host, tunnel.target_host, tunnel.out_port)
+
+
+def tunnel_owner(tunnel):
+    """PIDs of the process keeping the tunnel up (autossh, a supervisor or ssh itself), then of ssh."""
+    if type(tunnel) == AutoTunnel:
+        return tunnel.autossh_pid, tunnel.ssh_pid
+    elif type(tunnel) == SupervisedTunnel:
+        return tunnel.supervisor_pid, tunnel.ssh_pid
+    return tunnel.ssh_pid, tunnel.ssh_pid
+
+
+def tunnels_keys(tunnels):
+    """Return { key : Tunnel } for all the tunnels.
+
+    Tunnels with the same forward specification (e.g. a second ssh that failed to bind the port
+    of the first one) are told apart by an ordinal, in the order of their owner processes."""
+    specs = {}
+    for t in tunnels:
+        specs.setdefault(tunnel_key(t), []).append(t)
+    keys = {}
+    for spec, same in specs.items():
+        for i, t in enumerate(sorted(same, key=tunnel_owner)):
+            keys[spec + (i,)] = t
+    return keys
+
+
+class Condition:
+    """A test on a tunnel, parsed from a string like "established == 0" or "gone"."""
+
+    re_condition = re.compile(r"^(\w+)\s*(==|!=|<=|>=|<|>)\s*(-?\d+(?:\.\d+)?)$")
+
+    def __init__(self, text):
+        self.text = text.strip()
+        self.gone = self.text == 'gone'
+        if not self.gone:
+            match = self.re_condition.match(self.text)
+            if not match:
+                raise ValueError("invalid condition: '%s'" % self.text)
+            field, op, value = match.groups()
+            if field not in FIELDS:
+                raise ValueError("unknown field: '%s' (available: %s)" % (field, ", ".join(FIELDS)))
+            self.field = FIELDS[field]
+            self.op = OPERATORS[op]
+            self.value = float(value)
+
+    def __call__(self, tunnel, present):
+        if self.gone:
+            return not present
+        return present and self.op(self.field(tunnel), self.value)
+
+    def __repr__(self):
+        return self.text
+
+
+class Alert:
+    """A rule that fired on a tunnel."""
+
+    def __init__(self, rule, tunnel, timestamp):
+        self.rule = rule
+        self.tunnel = tunnel
+        self.timestamp = timestamp
+
+    def message(self):
+        return "%s\t%s\t%s\t%s" % (
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.timestamp)),
+            self.rule.name,
+            self.rule.condition,
+            self.tunnel.repr_tunnel())
+
+    def environ(self):
+        """Variables passed to exec hooks."""
+        t = self.tunnel
+        return {
+            'TUNNELMON_RULE': self.rule.name,
+            'TUNNELMON_CONDITION': str(self.rule.condition),
+            'TUNNELMON_TIME': "%i" % self.timestamp,
+            'TUNNELMON_FORWARD': t.forward,
+            'TUNNELMON_SSH_PID': "%i" % t.ssh_pid,
+            'TUNNELMON_IN_PORT': "%i" % t.in_port,
+            'TUNNELMON_VIA_HOST': t.via_host,
+            'TUNNELMON_TARGET_HOST': t.target_host,
+            'TUNNELMON_OUT_PORT': "%i" % t.out_port,
+            'TUNNELMON_NAMESPACE': t.namespace or "",
+            'TUNNELMON_MESSAGE': self.message(),
+        }
+
+
+class Hook:
+    """Something to do when an alert fires. Hooks are called from worker threads.
+
+    Subclasses have a kind, and are called with the Alert."""
+
+    def __init__(self, target, timeout=10):
+        self.target = target
+        self.timeout = timeout
+
+    def __repr__(self):
+        return "%s:%s" % (self.kind, self.target)
+
+
+class ExecHook(Hook):
+    """Run a command, with the alert in TUNNELMON_* environment variables."""
+    kind = 'exec'
+
+    def __init__(self, target, timeout=10):
+        super().__init__(target, timeout)
+        self.args = shlex.split(target)
+        if not self.args:
+            raise ValueError("empty command")
+
+    def __call__(self, alert):
+        env = dict(os.environ)
+        env.update(alert.environ())
+        # Never write to the terminal, which may be managed by curses.
+        subprocess.run(self.args, env=env, timeout=self.timeout,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class LogHook(Hook):
+    """Append the alert message to a file."""
+    kind = 'log'
+
+    def __init__(self, target, timeout=10):
+        super().__init__(os.path.expanduser(target), timeout)
+        self.lock = threading.Lock()
+
+    def __call__(self, alert):
+        with self.lock:
+            with open(self.target, 'a') as fd:
+                fd.write(alert.message() + "\n")
+
+
+class SocketHook(Hook):
+    """Send the alert message to a local (UNIX) socket, datagram or stream."""
+    kind = 'socket'
+
+    def __call__(self, alert):
+        data = (alert.message() + "\n").encode()
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.sendto(data, self.target)
+        except OSError:
+            # Not a datagram socket, try a stream one.
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.target)
+                sock.sendall(data)
+
+
+HOOKS = {h.kind: h for h in (ExecHook, LogHook, SocketHook)}
+
+
+def make_hook(spec, timeout=10):
+    """Build a hook from a "kind:target" string."""
+    kind, sep, target = spec.partition(':')
+    if not sep or kind not in HOOKS:
+        raise ValueError("invalid hook: '%s' (available: %s)" % (spec, ", ".join(HOOKS)))
+    return HOOKS[kind](target.strip(), timeout)
+
+
+class Rule:
+    def __init__(self, name, condition, hooks, delay=0, repeat=0):
+        self.name = name
+        self.condition = condition
+        self.hooks = hooks
+        self.delay = delay  # seconds the condition should hold before firing
+        self.repeat = repeat  # seconds between two firings while the condition holds, 0: once
+
+    def __repr__(self):
+        return "%s: %s" % (self.name, self.condition)
+
+
+class AlertsEngine:
+    """Evaluate rules on each refresh, and run the hooks of those that fire in a bounded pool of threads,
+    so that a slow hook never delays the refresh."""
+
+    def __init__(self, rules, workers=2, max_pending=64, max_gone=256):
+        self.rules = rules
+        self.max_pending = max_pending
+        self.max_gone = max_gone
+
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.pending = 0
+        self.lock = threading.Lock()
+
+        # { key : Tunnel } seen at the last refresh.
+        self.seen = {}
+        # { key : Tunnel } that have disappeared, the oldest ones being forgotten first.
+        self.gone = collections.OrderedDict()
+        # { (rule name, key) : [since, last fired] } for conditions that currently hold.
+        self.states = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Return an engine for the rules found in the configuration, or None if there is none."""
+        rules = []
+        for section in config.sections():
+            if not section.startswith('alert:'):
+                continue
+            name = section[len('alert:'):].strip()
+            # Do not interpolate, commands may contain '%'.
+            opts = config[section]
+            try:
+                condition = Condition(opts.get('condition', '', raw=True))
+                timeout = opts.getfloat('timeout', 10)
+                hooks = [make_hook(spec, timeout) for spec in opts.get('hooks', '', raw=True).splitlines() if spec.strip()]
+                rules.append(Rule(name, condition, hooks, opts.getfloat('delay', 0), opts.getfloat('repeat', 0)))
+            except ValueError as e:
+                logging.error("Invalid alert rule '%s': %s", name, e)
+
+        if not rules:
+            return None
+        logging.debug("Alert rules: %s", rules)
+
+        if config.has_section('alerts'):
+            opts = config['alerts']
+            return cls(rules, opts.getint('workers', 2), opts.getint('pending', 64))
+        else:
+            return cls(rules)
+
+    def check(self, tp, now=None):
+        """Evaluate the rules against the current state of the tunnels, fire those that should."""
+        if now is None:
+            now = time.time()
+
+        current = tunnels_keys(tp.tunnels.values())
+        for key in self.seen:
+            if key not in current:
+                self.gone[key] = self.seen[key]
+        for key in current:
+            self.gone.pop(key, None)
+        while len(self.gone) > self.max_gone:
+            self.gone.popitem(last=False)
+        self.seen = current
+
+        holding = set()
+        for rule in self.rules:
+            for tunnels, present in ((current, True), (self.gone, False)):
+                for key, tunnel in tunnels.items():
+                    if not rule.condition(tunnel, present):
+                        continue
+                    skey = (rule.name, key)
+                    holding.add(skey)
+                    state = self.states.setdefault(skey, [now, None])
+                    since, last = state
+                    # Debounce, then deduplicate.
+                    if now - since < rule.delay:
+                        continue
+                    if last is None or (rule.repeat > 0 and now - last >= rule.repeat):
+                        state[1] = now
+                        self.fire(Alert(rule, tunnel, now))
+
+        # Conditions that do not hold anymore are reset.
+        for skey in list(self.states):
+            if skey not in holding:
+                del self.states[skey]
+
+    def fire(self, alert):
+        if core.log_sensitive:
+            logging.warning("[SENSITIVE] Alert: %s", alert.message())
+        else:
+            logging.warning("Alert: %s", alert.rule)
+        for hook in alert.rule.hooks:
+            with self.lock:
+                if self.pending >= self.max_pending:
+                    logging.error("Too many pending alert hooks, dropping %s", hook.kind)
+                    continue
+                self.pending += 1
+            self.pool.submit(self.run_hook, hook, alert)
+
+    def run_hook(self, hook, alert):
+        try:
+            hook(alert)
+        except Exception as e:
+            logging.error("Alert hook %s failed: %s", hook.kind, e)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def close(self):
+        """Wait for the pending hooks."""
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+import logging
+import os
+import sys
+
+from . import core
+from .core import TunnelsParser, optional_columns
+
+DEFAULT_CONFIG = '~/.tunnelmon.conf'
+
+# One-shot modes that are served without parsing the whole command line,
+# nor importing the configuration and user interface machinery.
+# Health checks call these every few seconds, so interpreter startup matters.
+FAST_MODES = {
+    '-u': 'tunnels',
+    '--tunnels': 'tunnels',
+    '-n': 'connections',
+    '--connections': 'connections',
+}
+
+
+def load_config(filename=None):
+    """Read the configuration file (default: ~/.tunnelmon.conf)."""
+    import configparser
+
+    config = configparser.ConfigParser()
+    if filename is None:
+        filename = os.path.expanduser(DEFAULT_CONFIG)
+    try:
+        config.read(filename)
+    except configparser.MissingSectionHeaderError:
+        logging.error("'%s' contains no known configuration", filename)
+    return config
+
+
+def print_tunnels(tp):
+    print(tp.header)
+    for t in tp.tunnels:
+        print(tp.tunnels[t].repr_tunnel(tp.columns))
+
+
+def print_connections(tp):
+    for t in tp.tunnels:
+        for c in tp.tunnels[t].connections:
+            print(tp.tunnels[t].ssh_pid, c)
+
+
+def fast_path(mode):
+    """Print tunnels or connections, skipping everything that is not needed for that."""
+    logging.basicConfig(level=logging.ERROR)
+    tp = TunnelsParser()
+    if mode == 'tunnels':
+        # The tunnels list does not need the (costly) sockets tables.
+        tp.update(connections=False)
+        print_tunnels(tp)
+    else:
+        tp.update()
+        print_connections(tp)
+    return 0
+
+
+def load_alerts(config):
+    from .alerts import AlertsEngine
+    return AlertsEngine.from_config(config)
+
+
+def load_health(asked_for, config):
+    if not (asked_for.check or asked_for.probe):
+        return None
+    from .health import HealthChecker
+    return HealthChecker(probe=asked_for.probe,
+                         timeout=config.getfloat('health', 'timeout', fallback=0.5),
+                         interval=config.getfloat('health', 'interval', fallback=30))
+
+
+def load_resources(asked_for):
+    if not asked_for.resources:
+        return None
+    from .resources import ResourceMeter
+    return ResourceMeter()
+
+
+def watch(alerts, health=None, recorder=None, resources=None, delay=1, stopped=None):
+    """Refresh the tunnels states periodically, without user interface, checking alerts,
+    until interrupted or until the stopped event is set (from another thread)."""
+    import threading
+
+    if stopped is None:
+        stopped = threading.Event()
+    tp = TunnelsParser()
+    try:
+        while not stopped.is_set():
+            tp.update()
+            if health:
+                health.check(tp, wait=False)
+            if resources:
+                resources.measure(tp)
+            if alerts:
+                alerts.check(tp)
+            if recorder:
+                recorder.record(tp)
+            stopped.wait(delay)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_curses(make_monitor):
+    """Set up the terminal, and run the monitor returned by make_monitor(screen)."""
+    import curses
+    import traceback
+
+    try:
+        scr = curses.initscr()
+        curses.start_color()
+
+        # 0:black, 1:red, 2:green, 3:yellow, 4:blue, 5:magenta, 6:cyan, 7:white
+        curses.init_pair(1, curses.COLOR_RED, curses.COLOR_BLACK)
+        curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
+        curses.init_pair(3, curses.COLOR_YELLOW, curses.COLOR_BLACK)
+        curses.init_pair(4, curses.COLOR_BLUE, curses.COLOR_BLACK)
+        curses.init_pair(5, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
+        curses.init_pair(6, curses.COLOR_CYAN, curses.COLOR_BLACK)
+        curses.init_pair(7, curses.COLOR_WHITE, curses.COLOR_BLACK)
+        curses.init_pair(8, curses.COLOR_WHITE, curses.COLOR_GREEN)
+        curses.init_pair(9, curses.COLOR_WHITE, curses.COLOR_BLUE)
+
+        curses.noecho()
+        curses.cbreak()
+        scr.keypad(1)
+
+        # create the monitor
+        mc = make_monitor(scr)
+        # call the monitor
+        mc()
+
+        scr.keypad(0)
+        curses.echo()
+        curses.nocbreak()
+        curses.endwin()
+
+    except:
+        # end cleanly
+        scr.keypad(0)
+        curses.echo()
+        curses.nocbreak()
+        curses.endwin()
+
+        # print the traceback
+        traceback.print_exc()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) == 1 and argv[0] in FAST_MODES:
+        return fast_path(FAST_MODES[argv[0]])
+
+    from optparse import OptionParser
+
+    usage = """%prog [options]
+    A user interface to monitor existing SSH tunnel that are managed with autossh.
+    Called without options, Tunnelmon displays a list of tunnels on the standard output.
+    Note: Users other than root will not see tunnels connections.
+    Version 1.1"""
+    parser = OptionParser(usage=usage, prog="tunnelmon")
+
+    parser.add_option("-c", "--curses",
+                      action="store_true", default=False,
+                      help="Start the user interface in text mode.")
+
+    parser.add_option("-w", "--watch",
+                      action="store_true", default=False,
+                      help="Refresh tunnels states every second without user interface, only checking alerts.")
+
+    parser.add_option("-k", "--check",
+                      action="store_true", default=False,
+                      help="Check that the forwarded ports are listened to by their ssh process, \
+            exit with status 1 if any is not.")
+
+    parser.add_option("-p", "--probe",
+                      action="store_true", default=False,
+                      help="Like --check, but also try to connect to the forwarded ports.")
+
+    parser.add_option("-r", "--resources",
+                      action="store_true", default=False,
+                      help="Measure the CPU, memory, file descriptors and context switches of the ssh processes.")
+
+    parser.add_option(core.SUPERVISOR_FLAG,
+                      action="store_true", default=False,
+                      help="Start the tunnels declared in the configuration file, and restart them when they exit. \
+            Alerts, records, checks and resources are watched along, as with --watch. \
+            With --curses, display the tunnels instead.")
+
+    parser.add_option("--record", default=None, metavar='FILE',
+                      help="Append the state of the tunnels to this file at each refresh, \
+            in the curses interface or in watch mode (the default with this option).")
+
+    parser.add_option("--replay", default=None, metavar='FILE',
+                      help="Display the tunnels recorded in this file, in the curses interface.")
+
+    parser.add_option("--speed", type="float", default=1.0, metavar='FACTOR',
+                      help="Replay speed, default: 1.")
+
+    parser.add_option("--seek", type="float", default=0, metavar='SECONDS',
+                      help="Start the replay this many seconds after the beginning of the recording.")
+
+    parser.add_option("-n", "--connections",
+                      action="store_true", default=False,
+                      help="Display only SSH connections related to a tunnel.")
+
+    parser.add_option("-u", "--tunnels",
+                      action="store_true", default=False,
+                      help="Display only the list of tunnels processes.")
+
+    LOG_LEVELS = {'error': logging.ERROR,
+                  'warning': logging.WARNING,
+                  'debug': logging.DEBUG}
+
+    parser.add_option('-l', '--log-level', choices=list(LOG_LEVELS), default='error', metavar='LEVEL',
+                      help='Log level (%s), default: %s.' % (", ".join(LOG_LEVELS), 'error'))
+
+    parser.add_option('-g', '--log-file', default=None, metavar='FILE',
+                      help="Log to this file, default to standard output. \
+            If you use the curses interface, you may want to set this to actually see logs.")
+
+    parser.add_option("-s", "--log-sensitive",
+                      action="store_true", default=False,
+                      help="Do log sensitive informations (like hostnames, IPs and PIDs).")
+
+    parser.add_option('-f', '--config-file', default=None, metavar='FILE',
+                      help="Use this configuration file (default: '%s')" % DEFAULT_CONFIG)
+
+    (asked_for, args) = parser.parse_args(argv)
+
+    logmsg = "----- Started Tunnelmon -----"
+
+    if asked_for.log_file:
+        logfile = asked_for.log_file
+        logging.basicConfig(filename=logfile, level=LOG_LEVELS[asked_for.log_level])
+        logging.debug(logmsg)
+        logging.debug("Log in %s", logfile)
+    else:
+        if asked_for.curses or asked_for.replay:
+            logging.warning("It's a bad idea to log to stdout while in the curses interface.")
+        logging.basicConfig(level=LOG_LEVELS[asked_for.log_level])
+        logging.debug(logmsg)
+        logging.debug("Log to stdout")
+
+    logging.debug("Asked for: %s" % asked_for)
+
+    if asked_for.log_sensitive:
+        logging.debug("Asked for logging sensitive information.")
+        core.log_sensitive = True
+
+    # unfortunately, asked_for class has no __len__ method in python 2.4.3 (bug?)
+    # if len(asked_for) > 1:
+    #    parser.error("asked_for are mutually exclusive")
+
+    config = load_config(asked_for.config_file)
+
+    # Load autossh instances by sections: [expected]
+    # if config['expected']:
+
+    health = load_health(asked_for, config)
+    resources = load_resources(asked_for)
+    healthy = True
+
+    recorder = None
+    if asked_for.record:
+        from .record import Recorder
+        recorder = Recorder(asked_for.record)
+
+    supervisor = None
+    if asked_for.supervise:
+        from .supervisor import Supervisor
+        supervisor = Supervisor.from_config(config)
+        if not supervisor.tunnels:
+            logging.error("No tunnel to supervise in the configuration file.")
+            return 2
+
+    if supervisor and not asked_for.curses:
+        logging.debug("Entering supervisor mode")
+        alerts = load_alerts(config)
+        watching = asked_for.watch or alerts or recorder or health or resources
+        if watching:
+            # The supervisor handles the signals, it needs the main thread.
+            import threading
+            stopped = threading.Event()
+            thread = threading.Thread(target=watch, args=(alerts, health, recorder, resources), kwargs={'stopped': stopped})
+            thread.start()
+        supervisor.serve()
+        if watching:
+            stopped.set()
+            thread.join()
+        if alerts:
+            alerts.close()
+
+    elif asked_for.replay:
+        logging.debug("Entering replay mode")
+        from .record import Recording, ReplayParser
+        from .interfaces import ReplayMonitor
+        try:
+            recording = Recording(asked_for.replay)
+        except (OSError, ValueError) as e:
+            logging.error("Cannot replay: %s", e)
+            return 2
+        replay = ReplayParser(recording, asked_for.speed, asked_for.seek)
+        run_curses(lambda scr: ReplayMonitor(scr, replay))
+        recording.close()
+
+    elif asked_for.curses:
+        logging.debug("Entering curses mode")
+        from .interfaces import CursesMonitor
+        alerts = load_alerts(config)
+        if supervisor:
+            import asyncio
+            import threading
+            thread = threading.Thread(target=asyncio.run, args=(supervisor.run(),))
+            thread.start()
+        run_curses(lambda scr: CursesMonitor(scr, alerts, health, recorder, resources, supervisor))
+        if supervisor:
+            supervisor.threadsafe(supervisor.stop)
+            thread.join()
+        if alerts:
+            alerts.close()
+
+    elif asked_for.watch or recorder:
+        logging.debug("Entering watch mode")
+        alerts = load_alerts(config)
+        if not alerts and not recorder:
+            logging.warning("No alert configured, watching for nothing.")
+        watch(alerts, health, recorder, resources)
+        if alerts:
+            alerts.close()
+
+    elif asked_for.connections:
+        logging.debug("Entering connections mode")
+        tp = TunnelsParser()
+        tp.update()
+        if health:
+            healthy = health.check(tp)
+        if core.log_sensitive:
+            logging.debug("[SENSITIVE] UID: %i", os.geteuid())
+        print_connections(tp)
+
+    elif asked_for.tunnels:
+        logging.debug("Entering tunnel mode")
+        tp = TunnelsParser(optional_columns(health, resources))
+        tp.update(connections=False)
+        if health:
+            healthy = health.check(tp)
+        if resources:
+            resources.measure(tp)
+        print_tunnels(tp)
+
+    else:
+        logging.debug("Entering default mode")
+        tp = TunnelsParser(optional_columns(health, resources))
+        # call update
+        tp.update()
+        if health:
+            healthy = health.check(tp)
+        if resources:
+            resources.measure(tp)
+        # call the default __repr__
+        print(tp)
+
+    if recorder:
+        recorder.close()
+
+    if not healthy:
+        return 1
+    return 0
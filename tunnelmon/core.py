@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# CORE
+#################################################################################################
+
+import time
+import logging
+import psutil
+import socket
+import re
+import collections
+
+log_sensitive = False
+
+# Command line flag of the supervisor mode, used to recognize the ssh processes it manages.
+SUPERVISOR_FLAG = '--supervise'
+
+
+def format_size(size):
+    """Compact size string without spaces (e.g. '5.2M'), usable as a column value."""
+    if size is None:
+        return "-"
+    for unit in ('', 'K', 'M', 'G'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'T'
+    if unit:
+        return "%.1f%s" % (size, unit)
+    return "%i" % size
+
+
+def format_optional(value, fmt="%s"):
+    return "-" if value is None else fmt % value
+
+
+# Columns of the tunnels lists.
+HEADER = ['TYPE', 'FORWARD', 'SSHPID', 'INPORT', 'VIA', 'TARGET', 'OUTPORT',
+          'UPTIME', 'RESTARTS', 'LASTRESTART', 'FLAPS', 'NETNS']
+
+# Columns that are only shown when their measure is asked for, with the way to format them.
+OPTIONAL_COLUMNS = {
+    'HEALTH': lambda t: t.health or "-",
+    'CPU%': lambda t: format_optional(t.cpu, "%.1f"),
+    'RSS': lambda t: format_size(t.rss),
+    'FDS': lambda t: format_optional(t.fds),
+    'CTXSW': lambda t: format_optional(t.ctx_switches),
+}
+HEALTH_COLUMNS = ['HEALTH']
+RESOURCES_COLUMNS = ['CPU%', 'RSS', 'FDS', 'CTXSW']
+
+
+def optional_columns(health=False, resources=False):
+    """Optional columns showing the measures that are asked for."""
+    columns = []
+    if health:
+        columns += HEALTH_COLUMNS
+    if resources:
+        columns += RESOURCES_COLUMNS
+    return columns
+
+
+def format_duration(seconds):
+    """Compact duration string without spaces (e.g. '2d03h', '4m05s'), usable as a column value."""
+    if seconds is None:
+        return "-"
+    seconds = max(0, int(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return "%id%02ih" % (days, hours)
+    elif hours:
+        return "%ih%02im" % (hours, minutes)
+    elif minutes:
+        return "%im%02is" % (minutes, seconds)
+    else:
+        return "%is" % seconds
+
+
+class Tunnel:
+    def __init__(self, ssh_pid=None, in_port=None, via_host=None, target_host=None, out_port=None, forward=None):
+        # assert ssh_pid is not None
+        self.ssh_pid = ssh_pid
+        assert in_port is not None
+        self.in_port = in_port
+        assert via_host is not None
+        self.via_host = via_host
+        assert target_host is not None
+        self.target_host = target_host
+        assert out_port is not None
+        self.out_port = out_port
+        assert forward is not None
+        self.forwards = {'L':'local', 'R':'remote', 'D': 'dynamic'}
+        if forward in self.forwards:
+            self.forward = self.forwards[forward]
+        else:
+            self.forward = "unknown"    
+
+        self.connections = []
+
+        # Lifetime of the ssh process, filled by TunnelsParser.update().
+        self.uptime = None  # seconds since the ssh process started
+        self.restarts = 0  # number of ssh respawns seen (autossh only)
+        self.last_restart = None  # seconds since the last respawn
+        self.flaps = 0  # number of respawns within the flapping window
+
+        # Whether the forwarded port is actually listened to, filled by health.HealthChecker.
+        self.health = None
+
+        # Resources used by the ssh process, filled by resources.ResourceMeter.
+        self.cpu = None  # percent
+        self.rss = None  # bytes
+        self.fds = None  # number of file descriptors
+        self.ctx_switches = None  # voluntary and involuntary
+
+        # Network namespace of the ssh process, None for the one of Tunnelmon, filled by netns.NetNamespaces.
+        self.namespace = None
+
+    def repr_tunnel(self, columns=()):
+        """Tab separated values, followed by those of the optional columns asked for."""
+        rep = "%s\t%i\t%i\t%s\t%s\t%i\t%s\t%i\t%s\t%i\t%s" % (
+            self.forward,
+            self.ssh_pid,
+            self.in_port,
+            self.via_host,
+            self.target_host,
+            self.out_port,
+            format_duration(self.uptime),
+            self.restarts,
+            format_duration(self.last_restart),
+            self.flaps,
+            self.namespace or "-")
+        for column in columns:
+            rep += "\t" + OPTIONAL_COLUMNS[column](self)
+        return rep
+
+    def repr_connections(self):
+        # list of tunnels linked to this process
+        rep = ""
+        for c in self.connections:
+            rep += "\n\t↳ %s" % c
+        return rep
+
+    def __repr__(self):
+        return self.repr_tunnel() + self.repr_connections()
+
+
+class AutoTunnel(Tunnel):
+    def __init__(self, autossh_pid=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert autossh_pid is not None
+        self.autossh_pid = autossh_pid
+
+    def repr_tunnel(self, columns=()):
+        rep = super().repr_tunnel(columns)
+        return "auto\t" + rep
+
+
+class SupervisedTunnel(Tunnel):
+    """A tunnel whose ssh process is managed by a tunnelmon supervisor, along with many others."""
+
+    def __init__(self, supervisor_pid=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert supervisor_pid is not None
+        self.supervisor_pid = supervisor_pid
+
+    def repr_tunnel(self, columns=()):
+        rep = super().repr_tunnel(columns)
+        return "super\t" + rep
+
+
+class RawTunnel(Tunnel):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def repr_tunnel(self, columns=()):
+        rep = super().repr_tunnel(columns)
+        return "ssh\t" + rep
+
+
+class Connection:
+    """A dictionary that stores an SSH connection related to a tunnel"""
+
+    def __init__(self, local_address=None, in_port=None, foreign_address=None, out_port=None,
+                 status=None, family=None):
+
+        # informations available with netstat
+        assert local_address is not None
+        self.local_address = local_address
+        assert in_port is not None
+        self.in_port = in_port
+        self.foreign_address = foreign_address
+        self.out_port = out_port
+        assert status is not None
+        self.status = status
+        assert family is not None
+        self.family = family
+
+        self.family_rep = {socket.AddressFamily.AF_INET: "INET", socket.AddressFamily.AF_INET6: "INET6", socket.AddressFamily.AF_UNIX: "UNIX"}
+
+        # TCP statistics (sockdiag.TcpInfo), only filled by sockdiag.SockDiag.
+        self.tcp = None
+
+    def __repr__(self):
+        # do not logging.debug all the informations by default
+        if self.foreign_address and self.out_port:
+            return "%s\t%s\t%s:%i → %s:%i" % (
+                self.family_rep[self.family],
+                self.status,
+                self.local_address,
+                self.in_port,
+                self.foreign_address,
+                self.out_port,
+            )
+        else:
+            return "%s\t%s\t%s:%i" % (
+                self.family_rep[self.family],
+                self.status,
+                self.local_address,
+                self.in_port,
+            )
+
+
+class SshChild:
+    """Identity and restart history of the ssh child of an autossh process (or of a supervisor).
+
+    A process is identified by its (pid, create_time) pair,
+    so that a recycled PID is not mistaken for the same process."""
+
+    def __init__(self, autossh_ctime, ssh_pid, ssh_ctime, max_flaps):
+        self.autossh_ctime = autossh_ctime
+        self.ssh_pid = ssh_pid
+        self.ssh_ctime = ssh_ctime
+        self.restarts = 0
+        self.last_restart = None  # timestamp
+        # Timestamps of the most recent restarts, bounded.
+        self.flaps = collections.deque(maxlen=max_flaps)
+
+    def is_same_autossh(self, autossh_ctime):
+        return self.autossh_ctime == autossh_ctime
+
+    def is_same_ssh(self, ssh_pid, ssh_ctime):
+        return self.ssh_pid == ssh_pid and self.ssh_ctime == ssh_ctime
+
+    def restarted(self, ssh_pid, ssh_ctime):
+        self.ssh_pid = ssh_pid
+        self.ssh_ctime = ssh_ctime
+        self.restarts += 1
+        self.last_restart = ssh_ctime
+        self.flaps.append(ssh_ctime)
+
+    def nb_flaps(self, now, window):
+        # Forget about restarts that are out of the window.
+        while self.flaps and self.flaps[0] < now - window:
+            self.flaps.popleft()
+        return len(self.flaps)
+
+
+class TunnelsParser:
+    def __init__(self, columns=()):
+        """Warning: the initialization does not gather tunnels informations, use update() to do so"""
+
+        # { ssh_pid : Tunnel }
+        self.tunnels = collections.OrderedDict()
+
+        # time of the last update
+        self.timestamp = None
+
+        # { autossh_pid or (supervisor_pid, forward, in_port) : SshChild }
+        # Kept across updates, to detect when autossh (or a supervisor) respawns its ssh child.
+        self.children = {}
+        self.flap_window = 600  # seconds
+        self.flap_max = 32  # maximum number of restarts remembered per autossh process
+
+        # Sockets tables of the network namespaces of the tunnels.
+        from .netns import NetNamespaces
+        self.netns = NetNamespaces()
+
+        # do not perform update by default
+        # this is necessary because one may want
+        # only a list of connections OR autossh processes
+        # self.update()
+
+        self.re_forwarding = re.compile(r"-\w*([LRD])\w*\s*(\d+):(.*):(\d+)")
+
+        # Optional columns to show (see OPTIONAL_COLUMNS).
+        self.columns = list(columns)
+
+    @property
+    def header(self):
+        return "\t".join(HEADER + self.columns)
+
+    def get_tunnel(self, pos):
+        pid = list(self.tunnels.keys())[pos]
+        return self.tunnels[pid]
+
+    def parse(self, cmd):
+        try:
+            cmdline = " ".join(cmd)
+        except TypeError:
+            cmdline = cmd
+
+        if log_sensitive:
+            logging.debug("[SENSITIVE] autossh cmd line: %s", cmdline)
+        logging.debug("forwarding regexp: %s" % self.re_forwarding)
+        match = self.re_forwarding.findall(cmdline)
+        if log_sensitive:
+            logging.debug("[SENSITIVE] match: %s", match)
+        if match:
+            assert len(match) == 1
+            forward, in_port, target_host, out_port = match[0]
+            if log_sensitive:
+                logging.debug("[SENSITIVE] matches: %s", match)
+        else:
+            raise ValueError("is not a ssh tunnel")
+
+        # Find the hostname on wich the tunnel is built.
+        via_host = "unknown"
+        # Search backward and take the first parameter argument.
+        # FIXME this is an ugly hack
+        i = 1
+        while i < len(cmd):
+            if log_sensitive:
+                logging.debug("[SENSITIVE] here: %i %s", i, cmd[i])
+            if cmd[i][0] == '-':
+                if cmd[i][1] in '46AaCfGgKkMNnqsTtVvXxYy':
+                    # flag without argument
+                    pass
+                elif len(cmd[i]) == 2:  # the argument is likely the next one
+                    if (i < len(cmd) - 1) and (cmd[i + 1][0] != '-'):  # not another flag (this should always be true)
+                        i += 1  # skip the argument
+                # skip the argument
+                i += 1
+            else:
+                via_host = cmd[i]
+                break
+
+        return int(in_port), via_host, target_host, int(out_port), forward
+
+    def update(self, connections=True):
+        """Gather and parse informations from the operating system
+
+        If connections is False, the sockets of the tunnels are not looked up, which is much faster."""
+
+        self.tunnels.clear()
+        now = time.time()
+        self.timestamp = now
+
+        # autossh processes that are still alive.
+        autossh_pids = set()
+
+        attrs = ['pid', 'ppid', 'name', 'cmdline', 'create_time']
+        if connections and not self.netns.available:
+            # psutil only sees the sockets of the namespace of Tunnelmon, but works beyond Linux.
+            attrs.append('connections')
+
+        # Browse the SSH processes handling a tunnel.
+        # Only the name of every process is read, details are fetched for [auto]ssh ones only.
+        for proc in psutil.process_iter(attrs=['name']):
+            if proc.info['name'] == 'autossh':
+                autossh_pids.add(proc.pid)
+                continue
+            elif proc.info['name'] != 'ssh':
+                continue
+
+            try:
+                process = proc.as_dict(attrs=attrs)
+                cmd = process['cmdline']
+            except psutil.NoSuchProcess:
+                pass
+            else:
+                if cmd and process['create_time'] is not None:
+                    if log_sensitive:
+                        logging.debug("[SENSITIVE] process: %s ", process)
+                    try:
+                        in_port, via_host, target_host, out_port, forward = self.parse(cmd)
+                    except ValueError:
+                        continue
+                    if log_sensitive:
+                        logging.debug("[SENSITIVE] parsed: %s %s %s %s %s", in_port, via_host, target_host, out_port, forward)
+
+                    # Check if this ssh tunnel is managed by autossh, or by a supervisor.
+                    try:
+                        parent = psutil.Process(process['ppid'])
+                        is_auto = parent.name() == 'autossh'
+                        is_super = not is_auto and SUPERVISOR_FLAG in parent.cmdline()
+                        parent_ctime = parent.create_time()
+                    except (psutil.NoSuchProcess, psutil.AccessDenied):
+                        is_auto = is_super = False
+                    if is_auto:
+                        # Add an autossh tunnel.
+                        pid = parent.pid  # autossh pid
+                        self.tunnels[pid] = AutoTunnel(pid, process['pid'], in_port, via_host, target_host, out_port, forward)
+                        autossh_pids.add(pid)
+                        self.track(self.tunnels[pid], pid, parent_ctime, process['create_time'], now)
+                    elif is_super:
+                        # Add a supervised tunnel, a supervisor handles several of them.
+                        pid = process['pid']
+                        self.tunnels[pid] = SupervisedTunnel(parent.pid, pid, in_port, via_host, target_host, out_port, forward)
+                        key = (parent.pid, forward, in_port)
+                        self.track(self.tunnels[pid], key, parent_ctime, process['create_time'], now)
+                    else:
+                        # Add a raw tunnel.
+                        pid = process['pid']
+                        self.tunnels[pid] = RawTunnel(pid, in_port, via_host, target_host, out_port, forward)
+                    self.tunnels[pid].uptime = now - process['create_time']
+
+                    for c in process.get('connections') or []:
+                        if log_sensitive:
+                            logging.debug("[SENSITIVE] connection: %s", c)
+                        laddr, lport = c.laddr
+                        if c.raddr:
+                            raddr, rport = c.raddr
+                        else:
+                            raddr, rport = (None, None)
+                        connection = Connection(laddr, lport, raddr, rport, c.status, c.family)
+                        if log_sensitive:
+                            logging.debug("[SENSITIVE] connection: %s", connection)
+                        self.tunnels[pid].connections.append(connection)
+
+        if self.netns.available:
+            self.netns.collect(self.tunnels, connections)
+
+        # Forget about autossh processes (and supervisors) that have gone,
+        # but keep those which are between two ssh children.
+        for key in list(self.children):
+            if type(key) == tuple:
+                alive = psutil.pid_exists(key[0])
+            else:
+                alive = key in autossh_pids
+            if not alive:
+                del self.children[key]
+
+        if log_sensitive:
+            logging.debug("[SENSITIVE] %s", self.tunnels)
+
+    def track(self, tunnel, key, autossh_ctime, ssh_ctime, now):
+        """Detect if the ssh child of an autossh (or supervised) tunnel has been respawned since the last update."""
+        child = self.children.get(key)
+        if child is None or not child.is_same_autossh(autossh_ctime):
+            # First time seen, or a new autossh process recycling an old PID.
+            child = SshChild(autossh_ctime, tunnel.ssh_pid, ssh_ctime, self.flap_max)
+            self.children[key] = child
+        elif not child.is_same_ssh(tunnel.ssh_pid, ssh_ctime):
+            if log_sensitive:
+                logging.debug("[SENSITIVE] %s restarted ssh: %i -> %i", key, child.ssh_pid, tunnel.ssh_pid)
+            else:
+                logging.debug("autossh restarted ssh")
+            child.restarted(tunnel.ssh_pid, ssh_ctime)
+
+        tunnel.restarts = child.restarts
+        if child.last_restart is not None:
+            tunnel.last_restart = now - child.last_restart
+        tunnel.flaps = child.nb_flaps(now, self.flap_window)
+
+    def __repr__(self):
+        reps = [self.header]
+        for t in self.tunnels:
+            reps.append(self.tunnels[t].repr_tunnel(self.columns) + self.tunnels[t].repr_connections())
+        return "\n".join(reps)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# HEALTH
+#################################################################################################
+
+import collections
+import concurrent.futures
+import errno
+import logging
+import selectors
+import socket
+import time
+
+import psutil
+
+from . import core
+
+# Possible health of a tunnel.
+OK = 'ok'  # the forwarded port is listened to by the ssh process (and accepts connections, if probed)
+UNBOUND = 'unbound'  # nobody listens to the forwarded port
+BUSY = 'busy'  # another process listens to the forwarded port
+REFUSED = 'refused'  # the forwarded port is listened to, but the probe connection was refused or closed right away
+UNKNOWN = 'unknown'  # the owner of the listening socket cannot be seen (not root)
+REMOTE = 'remote'  # the forwarded port is on the remote side, cannot be checked from here
+
+# Health states that are not considered a failure.
+HEALTHY = (OK, UNKNOWN, REMOTE, None)
+
+
+def probe(addresses, timeout=0.5):
+    """Try to connect to all the (host, port) addresses at once,
+    return a { address : bool } telling which ones accepted the connection and kept it open
+    for the timeout.
+
+    The kernel accepts connections to a listening socket before ssh does, thus the connection
+    itself does not tell if the forward works. But ssh closes it as soon as the remote side fails
+    to open the channel to the target, hence the wait for an end of file (or a reset)."""
+    results = {}
+    sel = selectors.DefaultSelector()
+    for address in addresses:
+        family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex(address)
+        if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sel.register(sock, selectors.EVENT_WRITE, address)
+        elif err == 0:
+            sel.register(sock, selectors.EVENT_READ, address)
+        else:
+            results[address] = False
+            sock.close()
+
+    deadline = time.monotonic() + timeout
+    while sel.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        for key, events in sel.select(remaining):
+            sock = key.fileobj
+            if events & selectors.EVENT_WRITE:
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    # Connected, now wait for ssh to close it.
+                    sel.modify(sock, selectors.EVENT_READ, key.data)
+                    continue
+                results[key.data] = False
+            else:
+                try:
+                    # Some targets talk first (e.g. SSH servers).
+                    results[key.data] = sock.recv(1) != b''
+                except OSError:
+                    results[key.data] = False
+            sel.unregister(sock)
+            sock.close()
+
+    # Timed out: still connecting, or still connected.
+    for key in list(sel.get_map().values()):
+        results[key.data] = key.events == selectors.EVENT_READ
+        sel.unregister(key.fileobj)
+        key.fileobj.close()
+    sel.close()
+    return results
+
+
+class HealthChecker:
+    """Verify that the forwarded port of each tunnel is actually listened to by its ssh process,
+    and optionally that it accepts connections.
+
+    Note that probing a local forward makes ssh open a connection to the target."""
+
+    def __init__(self, probe=False, timeout=0.5, interval=30):
+        self.probe = probe
+        self.timeout = timeout  # seconds
+
+        # Probes that do not block the refresh are run by a single thread, every interval seconds
+        # (each one makes ssh open a channel to the target), and their results are used until the next one.
+        self.interval = interval
+        self.pool = None
+        self.probing = None  # Future of the running probe
+        self.probed = None  # monotonic time at which the last probe started
+        self.accepted = {}  # { address : bool } of the last finished probe
+
+        # { ssh_pid : health } of the last refresh.
+        self.results = {}
+
+    def listeners(self):
+        """Return { port : [(pid, address)] } for all the TCP sockets in LISTEN state, read in one go,
+        or None if the sockets table cannot be read."""
+        table = collections.defaultdict(list)
+        try:
+            conns = psutil.net_connections(kind='tcp')
+        except psutil.AccessDenied:
+            logging.warning("Cannot read the sockets table")
+            return None
+        for c in conns:
+            if c.status == psutil.CONN_LISTEN:
+                table[c.laddr[1]].append((c.pid, c.laddr[0]))
+        return table
+
+    def verify(self, tunnel, listeners):
+        """Return the health of the tunnel and the address on which its ssh process listens (or None)."""
+        if tunnel.forward == 'remote':
+            return REMOTE, None
+        if listeners is None:
+            return UNKNOWN, None
+        socks = listeners.get(tunnel.in_port)
+        if not socks:
+            return UNBOUND, None
+        for pid, ip in socks:
+            if pid == tunnel.ssh_pid:
+                # Wildcard addresses are probed on the loopback.
+                if ip == '0.0.0.0':
+                    ip = '127.0.0.1'
+                elif ip == '::':
+                    ip = '::1'
+                return OK, (ip, tunnel.in_port)
+        if any(pid is None for pid, ip in socks):
+            return UNKNOWN, None
+        return BUSY, None
+
+    def verify_namespaced(self, tunnel, listening):
+        """Return the health of a tunnel in another network namespace,
+        from the set of ports listened to in that namespace (or None).
+        Its ports cannot be probed from here."""
+        if tunnel.forward == 'remote':
+            return REMOTE
+        if listening is None:
+            return UNKNOWN
+        if any(c.status == 'LISTEN' and c.in_port == tunnel.in_port for c in tunnel.connections):
+            return OK
+        if tunnel.in_port in listening:
+            return BUSY
+        return UNBOUND
+
+    def probe_background(self, addresses):
+        """Start a probe of the addresses if none is running and the interval elapsed,
+        return the results of the last finished one."""
+        if self.probing is not None and self.probing.done():
+            try:
+                self.accepted = self.probing.result()
+            except OSError as e:
+                logging.warning("Cannot probe the tunnels: %s", e)
+            self.probing = None
+        now = time.monotonic()
+        if self.probing is None and (self.probed is None or now - self.probed >= self.interval):
+            self.probed = now
+            if self.pool is None:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.probing = self.pool.submit(probe, addresses, self.timeout)
+        return self.accepted
+
+    def check(self, tp, wait=True):
+        """Set the health of all the tunnels of the parser, return True if they are all healthy.
+
+        If wait is False, probes are run in the background, so as not to block the refresh
+        for up to timeout seconds, and their results show up at the next check."""
+        listeners = self.listeners()
+        results = {}
+        addresses = {}
+        for t in tp.tunnels.values():
+            if t.namespace is not None:
+                results[t.ssh_pid] = self.verify_namespaced(t, tp.netns.listening.get(t.namespace))
+                continue
+            results[t.ssh_pid], address = self.verify(t, listeners)
+            if address is not None:
+                addresses[t.ssh_pid] = address
+
+        if self.probe and addresses:
+            if wait:
+                accepted = probe(set(addresses.values()), self.timeout)
+            else:
+                accepted = self.probe_background(set(addresses.values()))
+            for pid, address in addresses.items():
+                # Not probed yet: trust the listening sockets.
+                if not accepted.get(address, True):
+                    results[pid] = REFUSED
+
+        for t in tp.tunnels.values():
+            t.health = results[t.ssh_pid]
+            if t.health not in HEALTHY:
+                if core.log_sensitive:
+                    logging.debug("[SENSITIVE] Tunnel on port %i is %s", t.in_port, t.health)
+                else:
+                    logging.debug("A tunnel is %s", t.health)
+
+        self.results = results
+        return all(h in HEALTHY for h in results.values())
@@ -1,4 +1,3 @@
-#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
 # Tunnelmon is an AutoSSH tunnel monitor
@@ -21,264 +20,50 @@
 #
 
 #################################################################################################
-# CORE
+# INTERFACES
 #################################################################################################
 
-import signal
-import time
 import curses
-import os
-import subprocess
+import itertools
 import logging
-import psutil
-import socket
+import os
 import re
-import collections
-import itertools
-
-log_sensitive = False
-
-class Tunnel:
-    def __init__(self, ssh_pid=None, in_port=None, via_host=None, target_host=None, out_port=None, forward=None):
-        # assert ssh_pid is not None
-        self.ssh_pid = ssh_pid
-        assert in_port is not None
-        self.in_port = in_port
-        assert via_host is not None
-        self.via_host = via_host
-        assert target_host is not None
-        self.target_host = target_host
-        assert out_port is not None
-        self.out_port = out_port
-        assert forward is not None
-        self.forwards = {'L':'local', 'R':'remote', 'D': 'dynamic'}
-        if forward in self.forwards:
-            self.forward = self.forwards[forward]
-        else:
-            self.forward = "unknown"    
-
-        self.connections = []
-
-    def repr_tunnel(self):
-        return "%s\t%i\t%i\t%s\t%s\t%i" % (
-            self.forward,
-            self.ssh_pid,
-            self.in_port,
-            self.via_host,
-            self.target_host,
-            self.out_port)
-
-    def repr_connections(self):
-        # list of tunnels linked to this process
-        rep = ""
-        for c in self.connections:
-            rep += "\n\t↳ %s" % c
-        return rep
-
-    def __repr__(self):
-        return self.repr_tunnel() + self.repr_connections()
-
-
-class AutoTunnel(Tunnel):
-    def __init__(self, autossh_pid=None, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        assert autossh_pid is not None
-        self.autossh_pid = autossh_pid
-
-    def repr_tunnel(self):
-        rep = super().repr_tunnel()
-        return "auto\t" + rep
-
-
-class RawTunnel(Tunnel):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    def repr_tunnel(self):
-        rep = super().repr_tunnel()
-        return "ssh\t" + rep
-
-
-class Connection:
-    """A dictionary that stores an SSH connection related to a tunnel"""
-
-    def __init__(self, local_address=None, in_port=None, foreign_address=None, out_port=None,
-                 status=None, family=None):
-
-        # informations available with netstat
-        assert local_address is not None
-        self.local_address = local_address
-        assert in_port is not None
-        self.in_port = in_port
-        self.foreign_address = foreign_address
-        self.out_port = out_port
-        assert status is not None
-        self.status = status
-        assert family is not None
-        self.family = family
-
-        self.family_rep = {socket.AddressFamily.AF_INET: "INET", socket.AddressFamily.AF_INET6: "INET6", socket.AddressFamily.AF_UNIX: "UNIX"}
-
-        # FIXME would be nice to have an estimation of the connections latency
-        #self.latency = 0
-
-    def __repr__(self):
-        # do not logging.debug all the informations by default
-        if self.foreign_address and self.out_port:
-            return "%s\t%s\t%s:%i → %s:%i" % (
-                self.family_rep[self.family],
-                self.status,
-                self.local_address,
-                self.in_port,
-                self.foreign_address,
-                self.out_port,
-            )
-        else:
-            return "%s\t%s\t%s:%i" % (
-                self.family_rep[self.family],
-                self.status,
-                self.local_address,
-                self.in_port,
-            )
-
-
-class TunnelsParser:
-    def __init__(self):
-        """Warning: the initialization does not gather tunnels informations, use update() to do so"""
-
-        # { ssh_pid : Tunnel }
-        self.tunnels = collections.OrderedDict()
-
-        # do not perform update by default
-        # this is necessary because one may want
-        # only a list of connections OR autossh processes
-        # self.update()
-
-        self.re_forwarding = re.compile(r"-\w*([LRD])\w*\s*(\d+):(.*):(\d+)")
-
-        self.header = 'TYPE\tFORWARD\tSSHPID\tINPORT\tVIA\tTARGET\tOUTPORT'
-
-    def get_tunnel(self, pos):
-        pid = list(self.tunnels.keys())[pos]
-        return self.tunnels[pid]
-
-    def parse(self, cmd):
-        try:
-            cmdline = " ".join(cmd)
-        except TypeError:
-            cmdline = cmd
-
-        if log_sensitive:
-            logging.debug("[SENSITIVE] autossh cmd line: %s", cmdline)
-        logging.debug("forwarding regexp: %s" % self.re_forwarding)
-        match = self.re_forwarding.findall(cmdline)
-        if log_sensitive:
-            logging.debug("[SENSITIVE] match: %s", match)
-        if match:
-            assert len(match) == 1
-            forward, in_port, target_host, out_port = match[0]
-            if log_sensitive:
-                logging.debug("[SENSITIVE] matches: %s", match)
-        else:
-            raise ValueError("is not a ssh tunnel")
-
-        # Find the hostname on wich the tunnel is built.
-        via_host = "unknown"
-        # Search backward and take the first parameter argument.
-        # FIXME this is an ugly hack
-        i = 1
-        while i < len(cmd):
-            if log_sensitive:
-                logging.debug("[SENSITIVE] here: %i %s", i, cmd[i])
-            if cmd[i][0] == '-':
-                if cmd[i][1] in '46AaCfGgKkMNnqsTtVvXxYy':
-                    # flag without argument
-                    pass
-                elif len(cmd[i]) == 2:  # the argument is likely the next one
-                    if (i < len(cmd) - 1) and (cmd[i + 1][0] != '-'):  # not another flag (this should always be true)
-                        i += 1  # skip the argument
-                # skip the argument
-                i += 1
-            else:
-                via_host = cmd[i]
-                break
-
-        return int(in_port), via_host, target_host, int(out_port), forward
-
-    def update(self):
-        """Gather and parse informations from the operating system"""
-
-        self.tunnels.clear()
-
-        # Browse the SSH processes handling a tunnel.
-        for proc in psutil.process_iter():
-            try:
-                process = proc.as_dict(attrs=['pid', 'ppid', 'name', 'cmdline', 'connections'])
-                cmd = process['cmdline']
-            except psutil.NoSuchProcess:
-                pass
-            else:
-                if process['name'] == 'ssh':
-                    if log_sensitive:
-                        logging.debug("[SENSITIVE] process: %s ", process)
-                    try:
-                        in_port, via_host, target_host, out_port, forward = self.parse(cmd)
-                    except ValueError:
-                        continue
-                    if log_sensitive:
-                        logging.debug("[SENSITIVE] parsed: %s %s %s %s %s", in_port, via_host, target_host, out_port, forward)
-
-                    # Check if this ssh tunnel is managed by autossh.
-                    parent = psutil.Process(process['ppid'])
-                    if parent.name() == 'autossh':
-                        # Add an autossh tunnel.
-                        pid = parent.pid  # autossh pid
-                        self.tunnels[pid] = AutoTunnel(pid, process['pid'], in_port, via_host, target_host, out_port, forward)
-                    else:
-                        # Add a raw tunnel.
-                        pid = process['pid']
-                        self.tunnels[pid] = RawTunnel(pid, in_port, via_host, target_host, out_port, forward)
-
-                    for c in process['connections']:
-                        if log_sensitive:
-                            logging.debug("[SENSITIVE] connection: %s", c)
-                        laddr, lport = c.laddr
-                        if c.raddr:
-                            raddr, rport = c.raddr
-                        else:
-                            raddr, rport = (None, None)
-                        connection = Connection(laddr, lport, raddr, rport, c.status, c.family)
-                        if log_sensitive:
-                            logging.debug("[SENSITIVE] connection: %s", connection)
-                        self.tunnels[pid].connections.append(connection)
-
-        if log_sensitive:
-            logging.debug("[SENSITIVE] %s", self.tunnels)
-
-    def __repr__(self):
-        reps = [self.header]
-        for t in self.tunnels:
-            reps.append(str(self.tunnels[t]))
-        return "\n".join(reps)
-
+import signal
+import time
 
-#################################################################################################
-# INTERFACES
-#################################################################################################
+from . import core
+from .core import TunnelsParser, AutoTunnel, SupervisedTunnel, format_duration, format_size, HEADER, optional_columns
+from .health import HEALTHY
+from .sockdiag import SockDiag
 
 
 class CursesMonitor:
     """Textual user interface to display up-to-date informations about current tunnels"""
 
-    def __init__(self, scr):
+    def __init__(self, scr, alerts=None, health=None, recorder=None, resources=None, supervisor=None):
         # hide cursor
         curses.curs_set(0)
 
         # curses screen
         self.scr = scr
 
-        # tunnels monitor
-        self.tp = TunnelsParser()
+        # tunnels monitor, showing the optional columns of the measures asked for
+        self.tp = TunnelsParser(optional_columns(health, resources))
+
+        # listening ports checker, run at each update
+        self.health = health
+
+        # alerts engine, checked at each update
+        self.alerts = alerts
+
+        # record.Recorder, saving the state at each update
+        self.recorder = recorder
+
+        # resources.ResourceMeter, measuring the ssh processes at each update
+        self.resources = resources
+
+        # supervisor.Supervisor running in this process, if any
+        self.supervisor = supervisor
 
         # selected line
         self.cur_line = -1
@@ -289,15 +74,21 @@ class CursesMonitor:
         # switch to show only autoss processes (False) or ssh connections also (True)
         self.show_connections = False
 
+        # switch to show the TCP statistics of the connections of the selected tunnel
+        self.show_details = False
+        self.sockdiag = SockDiag()
+
         # FIXME pass as parameters+options
         self.update_delay = 1  # seconds of delay between two data updates
         self.ui_delay = 0.05  # seconds between two screen update
+        self.cpu_high = 50  # percent of CPU above which an ssh process is shown in red
 
         # colors
         # 0:black, 1:red, 2:green, 3:yellow, 4:blue, 5:magenta, 6:cyan, and 7:white.
         self.colors_tunnel = {
             'kind_auto'      : curses.COLOR_CYAN,
             'kind_raw'       : curses.COLOR_BLUE,
+            'kind_super'     : curses.COLOR_MAGENTA,
             'ssh_pid'        : curses.COLOR_WHITE,
             'in_port'        : curses.COLOR_YELLOW,
             'out_port'       : curses.COLOR_YELLOW,
@@ -315,10 +106,27 @@ class CursesMonitor:
             'forward_remote' : curses.COLOR_CYAN,
             'forward_dynamic': curses.COLOR_YELLOW,
             'forward_unknown': curses.COLOR_WHITE,
+            'uptime'         : curses.COLOR_WHITE,
+            'restarts'       : curses.COLOR_WHITE,
+            'restarts_some'  : curses.COLOR_YELLOW,
+            'last_restart'   : curses.COLOR_WHITE,
+            'flaps'          : curses.COLOR_WHITE,
+            'flaps_some'     : curses.COLOR_RED,
+            'health'         : curses.COLOR_WHITE,
+            'health_ok'      : curses.COLOR_GREEN,
+            'health_bad'     : curses.COLOR_RED,
+            'cpu'            : curses.COLOR_WHITE,
+            'cpu_high'       : curses.COLOR_RED,
+            'rss'            : curses.COLOR_WHITE,
+            'fds'            : curses.COLOR_WHITE,
+            'ctx_switches'   : curses.COLOR_WHITE,
+            'namespace'      : curses.COLOR_WHITE,
+            'namespace_other': curses.COLOR_MAGENTA,
         }
         self.colors_highlight = {
             'kind_auto'      : 9,
             'kind_raw'       : 9,
+            'kind_super'     : 9,
             'ssh_pid'        : 9,
             'in_port'        : 9,
             'out_port'       : 9,
@@ -336,6 +144,22 @@ class CursesMonitor:
             'forward_remote' : 9,
             'forward_dynamic': 9,
             'forward_unknown': 9,
+            'uptime'         : 9,
+            'restarts'       : 9,
+            'restarts_some'  : 9,
+            'last_restart'   : 9,
+            'flaps'          : 9,
+            'flaps_some'     : 9,
+            'health'         : 9,
+            'health_ok'      : 9,
+            'health_bad'     : 9,
+            'cpu'            : 9,
+            'cpu_high'       : 9,
+            'rss'            : 9,
+            'fds'            : 9,
+            'ctx_switches'   : 9,
+            'namespace'      : 9,
+            'namespace_other': 9,
         }
         self.colors_connection = {
             'ssh_pid'        : curses.COLOR_WHITE,
@@ -348,9 +172,14 @@ class CursesMonitor:
             'out_port'       : curses.COLOR_YELLOW,
             'in_port_priv'   : curses.COLOR_RED,
             'out_port_priv'  : curses.COLOR_RED,
+            'stats'          : curses.COLOR_WHITE,
+            'stats_warn'     : curses.COLOR_YELLOW,
+            'stats_bad'      : curses.COLOR_RED,
         }
 
-        self.header = ("TYPE", "FORWARD", "SSHPID", "INPORT", "VIA", "TARGET", "OUTPORT")
+    @property
+    def header(self):
+        return tuple(HEADER + self.tp.columns)
 
     def do_Q(self):
         """Quit"""
@@ -369,9 +198,23 @@ class CursesMonitor:
             # send the SIGUSR1 signal
             if type(self.tp.get_tunnel(self.cur_line)) == AutoTunnel:
                 # autossh performs a reload of existing tunnels that it manages
-                if log_sensitive:
+                if core.log_sensitive:
                     logging.debug("[SENSITIVE] SIGUSR1 on PID: %i", self.cur_pid)
                 os.kill(self.cur_pid, signal.SIGUSR1)
+            elif type(self.tp.get_tunnel(self.cur_line)) == SupervisedTunnel:
+                ssh_pid = self.tp.get_tunnel(self.cur_line).ssh_pid
+                if self.supervisor and self.tp.get_tunnel(self.cur_line).supervisor_pid == os.getpid():
+                    # our own supervisor restarts it without backoff
+                    self.supervisor.threadsafe(lambda: self.supervisor.restart(ssh_pid))
+                    return True
+                # the supervisor restarts right away a ssh process that has been terminated by a SIGTERM
+                if core.log_sensitive:
+                    logging.debug("[SENSITIVE] SIGTERM on supervised ssh PID: %i", ssh_pid)
+                try:
+                    os.kill(ssh_pid, signal.SIGTERM)
+                except OSError:
+                    if core.log_sensitive:
+                        logging.error("[SENSITIVE] No such process: %i", ssh_pid)
             else:
                 logging.debug("Cannot reload a RAW tunnel")
         return True
@@ -388,20 +231,23 @@ class CursesMonitor:
 
             tunnel = self.tp.get_tunnel(self.cur_line)
             if type(tunnel) == AutoTunnel:
-                if log_sensitive:
+                if core.log_sensitive:
                     logging.debug("[SENSITIVE] SIGKILL on autossh PID: %i", self.cur_pid)
                 try:
                     os.kill(self.cur_pid, signal.SIGKILL)
                 except OSError:
-                    if log_sensitive:
+                    if core.log_sensitive:
                         logging.error("[SENSITIVE] No such process: %i", self.cur_pid)
 
-            if log_sensitive:
+            elif type(tunnel) == SupervisedTunnel:
+                logging.debug("A supervised tunnel will be restarted by its supervisor")
+
+            if core.log_sensitive:
                 logging.debug("[SENSITIVE] SIGKILL on ssh PID: %i", tunnel.ssh_pid)
             try:
                 os.kill(tunnel.ssh_pid, signal.SIGKILL)
             except OSError:
-                if log_sensitive:
+                if core.log_sensitive:
                     logging.error("[SENSITIVE] No such process: %i", tunnel.ssh_pid)
         self.cur_line -= 1
         self.cur_pid = -1
@@ -416,6 +262,16 @@ class CursesMonitor:
         self.show_connections = not self.show_connections
         return True
 
+    def do_D(self):
+        """Show connections details"""
+        logging.debug("Waited: %s", self.log_ticks)
+        self.log_ticks = ""
+        logging.debug("Key pushed: D")
+        self.show_details = not self.show_details
+        if self.show_details:
+            self.sockdiag.collect(self.tp)
+        return True
+
     def do_258(self):
         """Move down"""
         logging.debug("Waited: %s", self.log_ticks)
@@ -467,6 +323,16 @@ class CursesMonitor:
             # if its time to update
             if time.time() > self.last_update + self.update_delay:
                 self.tp.update()
+                if self.health:
+                    self.health.check(self.tp, wait=False)
+                if self.resources:
+                    self.resources.measure(self.tp)
+                if self.alerts:
+                    self.alerts.check(self.tp)
+                if self.show_details:
+                    self.sockdiag.collect(self.tp)
+                if self.recorder:
+                    self.recorder.record(self.tp)
                 # reset the counter
                 self.last_update = time.time()
 
@@ -475,7 +341,7 @@ class CursesMonitor:
                     logging.debug("Waited: %s", self.log_ticks)
                     self.log_ticks = ""
                     logging.debug("----- Time of screen update: %s -----", time.time())
-                    if log_sensitive:
+                    if core.log_sensitive:
                         logging.debug("[SENSITIVE] State of tunnels:\n%s", self.tp)
                     self.last_state = state
                 else:
@@ -512,7 +378,7 @@ class CursesMonitor:
 
     def format(self):
         """Prepare formating strings to pad with spaces up to the column header width."""
-        reps = [self.tp.tunnels[t].repr_tunnel() for t in self.tp.tunnels]
+        reps = [self.tp.tunnels[t].repr_tunnel(self.tp.columns) for t in self.tp.tunnels]
         tuns = [t.split() for t in reps]
         tuns.append(self.header)
         cols = itertools.zip_longest(*tuns, fillvalue='')
@@ -566,7 +432,7 @@ class CursesMonitor:
             self.add_tunnel(l)
 
             # if one want to show connections
-            if self.show_connections:  # and os.getuid() == 0:
+            if self.show_connections or (self.show_details and l == self.cur_line):  # and os.getuid() == 0:
                 self.add_connection(l)
 
         self.scr.clrtobot()
@@ -603,8 +469,39 @@ class CursesMonitor:
                 self.scr.addstr(':')
                 self.scr.addstr(str(t.out_port), curses.color_pair(colors['out_port']))
 
+            if self.show_details and line == self.cur_line:
+                self.add_connection_stats(t)
+
             self.scr.clrtoeol()
 
+    def add_connection_stats(self, connection):
+        """Add the TCP statistics of a connection at the end of its line"""
+
+        colors = self.colors_connection
+
+        self.scr.addstr('\t')
+        tcp = connection.tcp
+        if tcp is None:
+            if self.sockdiag.available:
+                self.scr.addstr('no statistics', curses.color_pair(colors['stats']))
+            else:
+                self.scr.addstr('statistics unavailable', curses.color_pair(colors['stats_bad']))
+            return
+
+        self.scr.addstr('rtt ', curses.color_pair(colors['stats']))
+        self.scr.addstr('%.3fms' % (tcp.rtt / 1000), curses.color_pair(colors['stats']))
+        self.scr.addstr(' retrans ', curses.color_pair(colors['stats']))
+        self.scr.addstr(str(tcp.retrans), curses.color_pair(colors['stats_bad' if tcp.retrans else 'stats']))
+        self.scr.addstr(' recvq ', curses.color_pair(colors['stats']))
+        self.scr.addstr(str(tcp.rqueue), curses.color_pair(colors['stats_warn' if tcp.rqueue else 'stats']))
+        self.scr.addstr(' sendq ', curses.color_pair(colors['stats']))
+        self.scr.addstr(str(tcp.wqueue), curses.color_pair(colors['stats_warn' if tcp.wqueue else 'stats']))
+        if tcp.bytes_acked is not None:
+            self.scr.addstr(' acked ', curses.color_pair(colors['stats']))
+            self.scr.addstr(str(tcp.bytes_acked), curses.color_pair(colors['stats']))
+            self.scr.addstr(' received ', curses.color_pair(colors['stats']))
+            self.scr.addstr(str(tcp.bytes_received), curses.color_pair(colors['stats']))
+
     def add_tunnel(self, line):
         """Add line corresponding to the line-th autossh process"""
         self.scr.addstr('\n')
@@ -623,6 +520,9 @@ class CursesMonitor:
             self.scr.addstr(self.format()[0].format('auto'), curses.color_pair(colors['kind_auto']))
             # Trailing space.
             self.scr.addstr(' ',   curses.color_pair(colors['kind_auto']))
+        elif type(self.tp.get_tunnel(line)) == SupervisedTunnel:
+            self.scr.addstr(self.format()[0].format('super'), curses.color_pair(colors['kind_super']))
+            self.scr.addstr(' ',   curses.color_pair(colors['kind_super']))
         else:
             self.scr.addstr(self.format()[0].format('ssh'),  curses.color_pair(colors['kind_raw']))
             self.scr.addstr(' ',   curses.color_pair(colors['kind_raw']))
@@ -669,6 +569,63 @@ class CursesMonitor:
         else:
             self.add_tunnel_info('out_port'    , line, 6)
 
+        # UPTIME
+        self.scr.addstr(self.format()[7].format(format_duration(t.uptime)), curses.color_pair(colors['uptime']))
+        self.scr.addstr(' ',   curses.color_pair(colors['uptime']))
+
+        # RESTARTS
+        if t.restarts > 0:
+            self.scr.addstr(self.format()[8].format(t.restarts), curses.color_pair(colors['restarts_some']))
+            self.scr.addstr(' ',   curses.color_pair(colors['restarts_some']))
+        else:
+            self.add_tunnel_info('restarts'    , line, 8)
+
+        # LASTRESTART
+        self.scr.addstr(self.format()[9].format(format_duration(t.last_restart)), curses.color_pair(colors['last_restart']))
+        self.scr.addstr(' ',   curses.color_pair(colors['last_restart']))
+
+        # FLAPS
+        if t.flaps > 0:
+            self.scr.addstr(self.format()[10].format(t.flaps), curses.color_pair(colors['flaps_some']))
+            self.scr.addstr(' ',   curses.color_pair(colors['flaps_some']))
+        else:
+            self.add_tunnel_info('flaps'    , line, 10)
+
+        # NETNS
+        if t.namespace is not None:
+            self.scr.addstr(self.format()[11].format(t.namespace), curses.color_pair(colors['namespace_other']))
+            self.scr.addstr(' ',   curses.color_pair(colors['namespace_other']))
+        else:
+            self.scr.addstr(self.format()[11].format('-'), curses.color_pair(colors['namespace']))
+            self.scr.addstr(' ',   curses.color_pair(colors['namespace']))
+
+        # Optional columns, after the fixed ones.
+        for col, column in enumerate(self.tp.columns, len(HEADER)):
+            if column == 'HEALTH':
+                if t.health is None:
+                    key = 'health'
+                elif t.health in HEALTHY:
+                    key = 'health_ok'
+                else:
+                    key = 'health_bad'
+                txt = t.health or '-'
+            elif column == 'CPU%':
+                key = 'cpu'
+                if t.cpu is not None and t.cpu >= self.cpu_high:
+                    key = 'cpu_high'
+                txt = '-' if t.cpu is None else '%.1f' % t.cpu
+            elif column == 'RSS':
+                key = 'rss'
+                txt = format_size(t.rss)
+            elif column == 'FDS':
+                key = 'fds'
+                txt = '-' if t.fds is None else t.fds
+            else: # CTXSW
+                key = 'ctx_switches'
+                txt = '-' if t.ctx_switches is None else t.ctx_switches
+            self.scr.addstr(self.format()[col].format(txt), curses.color_pair(colors[key]))
+            self.scr.addstr(' ',   curses.color_pair(colors[key]))
+
         # CONNECTIONS
         nb = len(self.tp.get_tunnel(line).connections)
         if nb > 0:
@@ -705,162 +662,79 @@ class CursesMonitor:
         self.scr.addstr(' ', curses.color_pair(colors[key]))
 
 
-if __name__ == "__main__":
-    import sys
-    from optparse import OptionParser
-    import configparser
-
-    usage = """%prog [options]
-    A user interface to monitor existing SSH tunnel that are managed with autossh.
-    Called without options, Tunnelmon displays a list of tunnels on the standard output.
-    Note: Users other than root will not see tunnels connections.
-    Version 0.3"""
-    parser = OptionParser(usage=usage)
-
-    parser.add_option("-c", "--curses",
-                      action="store_true", default=False,
-                      help="Start the user interface in text mode.")
-
-    parser.add_option("-n", "--connections",
-                      action="store_true", default=False,
-                      help="Display only SSH connections related to a tunnel.")
-
-    parser.add_option("-u", "--tunnels",
-                      action="store_true", default=False,
-                      help="Display only the list of tunnels processes.")
-
-    LOG_LEVELS = {'error': logging.ERROR,
-                  'warning': logging.WARNING,
-                  'debug': logging.DEBUG}
-
-    parser.add_option('-l', '--log-level', choices=list(LOG_LEVELS), default='error', metavar='LEVEL',
-                      help='Log level (%s), default: %s.' % (", ".join(LOG_LEVELS), 'error'))
-
-    parser.add_option('-g', '--log-file', default=None, metavar='FILE',
-                      help="Log to this file, default to standard output. \
-            If you use the curses interface, you may want to set this to actually see logs.")
-
-    parser.add_option("-s", "--log-sensitive",
-                      action="store_true", default=False,
-                      help="Do log sensitive informations (like hostnames, IPs and PIDs).")
-
-    parser.add_option('-f', '--config-file', default=None, metavar='FILE',
-                      help="Use this configuration file (default: '~/.tunnelmon.conf')")
-
-    (asked_for, args) = parser.parse_args()
-
-    logmsg = "----- Started Tunnelmon -----"
-
-    if asked_for.log_file:
-        logfile = asked_for.log_file
-        logging.basicConfig(filename=logfile, level=LOG_LEVELS[asked_for.log_level])
-        logging.debug(logmsg)
-        logging.debug("Log in %s", logfile)
-    else:
-        if asked_for.curses:
-            logging.warning("It's a bad idea to log to stdout while in the curses interface.")
-        logging.basicConfig(level=LOG_LEVELS[asked_for.log_level])
-        logging.debug(logmsg)
-        logging.debug("Log to stdout")
-
-    logging.debug("Asked for: %s" % asked_for)
-
-    if asked_for.log_sensitive:
-        logging.debug("Asked for logging sensitive information.")
-        log_sensitive = True
-
-    # unfortunately, asked_for class has no __len__ method in python 2.4.3 (bug?)
-    # if len(asked_for) > 1:
-    #    parser.error("asked_for are mutually exclusive")
-
-    config = configparser.ConfigParser()
-    if asked_for.config_file:
-        try:
-            config.read(asked_for.config_file)
-        except configparser.MissingSectionHeaderError:
-            logging.error("'%s' contains no known configuration", asked_for.config_file)
-    else:
-        try:
-            config.read('~/.tunnelmon.conf')
-        except configparser.MissingSectionHeaderError:
-            logging.error("'%s' contains no known configuration", asked_for.config_file)
-
-    # Load autossh instances by sections: [expected]
-    # if config['expected']:
-
-    if asked_for.curses:
-        logging.debug("Entering curses mode")
-        import curses
-        import traceback
-
-        try:
-            scr = curses.initscr()
-            curses.start_color()
-
-            # 0:black, 1:red, 2:green, 3:yellow, 4:blue, 5:magenta, 6:cyan, 7:white
-            curses.init_pair(1, curses.COLOR_RED, curses.COLOR_BLACK)
-            curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
-            curses.init_pair(3, curses.COLOR_YELLOW, curses.COLOR_BLACK)
-            curses.init_pair(4, curses.COLOR_BLUE, curses.COLOR_BLACK)
-            curses.init_pair(5, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
-            curses.init_pair(6, curses.COLOR_CYAN, curses.COLOR_BLACK)
-            curses.init_pair(7, curses.COLOR_WHITE, curses.COLOR_BLACK)
-            curses.init_pair(8, curses.COLOR_WHITE, curses.COLOR_GREEN)
-            curses.init_pair(9, curses.COLOR_WHITE, curses.COLOR_BLUE)
-
-            curses.noecho()
-            curses.cbreak()
-            scr.keypad(1)
-
-            # create the monitor
-            mc = CursesMonitor(scr)
-            # call the monitor
-            mc()
-
-            scr.keypad(0)
-            curses.echo()
-            curses.nocbreak()
-            curses.endwin()
-
-        except:
-            # end cleanly
-            scr.keypad(0)
-            curses.echo()
-            curses.nocbreak()
-            curses.endwin()
-
-            # print the traceback
-            traceback.print_exc()
-
-    elif asked_for.connections:
-        logging.debug("Entering connections mode")
-        tp = TunnelsParser()
-        tp.update()
-        # do not call update() but only get connections
-        if log_sensitive:
-            logging.debug("[SENSITIVE] UID: %i", os.geteuid())
-        # if os.geteuid() == 0:
-        for t in tp.tunnels:
-            for c in tp.tunnels[t].connections:
-                print(tp.tunnels[t].ssh_pid, c)
-
-        # else:
-        #     logging.error("Only root can see SSH tunnels connections.")
-
-    elif asked_for.tunnels:
-        logging.debug("Entering tunnel mode")
-        tp = TunnelsParser()
-        tp.update()
-        # do not call update() bu only get autossh processes
-        print(tp.header)
-        for t in tp.tunnels:
-            print(tp.tunnels[t].repr_tunnel())
-
-    else:
-        logging.debug("Entering default mode")
-        tp = TunnelsParser()
-        # call update
-        tp.update()
-        # call the default __repr__
-        print(tp)
+class ReplayMonitor(CursesMonitor):
+    """Textual user interface displaying the tunnels of a recording"""
+
+    def __init__(self, scr, parser):
+        super().__init__(scr)
+        # record.ReplayParser
+        self.tp = parser
+        # There is no live socket to ask statistics about.
+        self.sockdiag.available = False
+
+    def do_R(self):
+        """Reload (disabled)"""
+        return True
+
+    def do_C(self):
+        """Close (disabled)"""
+        return True
+
+    def do_P(self):
+        """Pause"""
+        logging.debug("Key pushed: P")
+        self.tp.update()
+        self.tp.paused = not self.tp.paused
+        return True
+
+    def do_F(self):
+        """Faster"""
+        logging.debug("Key pushed: F")
+        self.tp.update()
+        self.tp.speed *= 2
+        return True
+
+    def do_S(self):
+        """Slower"""
+        logging.debug("Key pushed: S")
+        self.tp.update()
+        self.tp.speed /= 2
+        return True
+
+    def seek(self, delta):
+        self.tp.seek(self.tp.position + delta)
+        # Update at the next tick.
+        self.last_update = 0
 
+    def do_260(self):
+        """Seek back one minute"""
+        logging.debug("Key pushed: left")
+        self.seek(-60)
+        return True
+
+    def do_261(self):
+        """Seek forward one minute"""
+        logging.debug("Key pushed: right")
+        self.seek(60)
+        return True
+
+    def do_339(self):
+        """Seek back one hour"""
+        logging.debug("Key pushed: page up")
+        self.seek(-3600)
+        return True
+
+    def do_338(self):
+        """Seek forward one hour"""
+        logging.debug("Key pushed: page down")
+        self.seek(3600)
+        return True
+
+    def display(self):
+        super().display()
+        height, width = self.scr.getmaxyx()
+        status = "Replay: %s x%g%s, [←/→] seek 1 minute, [PgUp/PgDn] seek 1 hour" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.tp.position)),
+            self.tp.speed,
+            " (paused)" if self.tp.paused else "")
+        self.scr.addstr(height - 1, 0, status[:width - 1], curses.color_pair(4))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# NETWORK NAMESPACES
+#################################################################################################
+
+# The sockets of a process are listed in the tables of its own network namespace,
+# which are not the ones of Tunnelmon if the process runs in a container.
+# Thus, the ssh processes are grouped by network namespace, the sockets tables of each namespace
+# are read once, from /proc/<pid>/net/ of one of its processes, and the sockets of each ssh process
+# are found there from the inodes of its file descriptors.
+# Tunnels that are not in the namespace of Tunnelmon are tagged with the ID of their container
+# (if it can be found in their control groups), or with the inode of their namespace.
+
+import logging
+import os
+import re
+import socket
+import struct
+import sys
+
+from . import core
+from .core import Connection
+
+# Columns of /proc/<pid>/net/tcp* are hexadecimal, with addresses in the host byte order.
+TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+    '0C': 'NEW_SYN_RECV',
+}
+
+# ssh only uses TCP.
+TABLES = (('tcp', socket.AF_INET), ('tcp6', socket.AF_INET6))
+
+# Docker, podman, containerd and kubernetes all name the control group after the 64 hexadecimal digits container ID.
+RE_CONTAINER = re.compile(r"[0-9a-f]{64}")
+
+
+def decode_address(address, family):
+    """Convert an "ip:port" address of /proc/net/tcp* to an (ip, port) pair, or (None, None) if the port is zero."""
+    ip, port = address.split(':')
+    port = int(port, 16)
+    if not port:
+        return None, None
+    packed = bytes.fromhex(ip)
+    if sys.byteorder == 'little':
+        # Every 32 bits word is in the host byte order.
+        packed = struct.pack('>%iI' % (len(packed) // 4), *struct.unpack('<%iI' % (len(packed) // 4), packed))
+    return socket.inet_ntop(family, packed), port
+
+
+class NetNamespaces:
+    """Find the sockets of the tunnels, whatever the network namespace of their ssh process."""
+
+    def __init__(self, proc='/proc'):
+        self.proc = proc
+        try:
+            self.own = self.namespace('self')
+        except OSError:
+            # Not Linux, psutil will be used instead.
+            self.own = None
+        self.available = self.own is not None
+
+        # { namespace inode : tag } of the namespaces seen at the last update.
+        self.tags = {}
+
+        # { tag : set of ports in LISTEN state } for the namespaces other than the one of Tunnelmon,
+        # of the last update (see health.HealthChecker).
+        self.listening = {}
+
+    def namespace(self, pid):
+        """Inode of the network namespace of a process."""
+        return os.stat(os.path.join(self.proc, str(pid), 'ns', 'net')).st_ino
+
+    def tag(self, inode, pid):
+        """Name of a namespace, None for the one of Tunnelmon."""
+        if inode == self.own:
+            return None
+        try:
+            with open(os.path.join(self.proc, str(pid), 'cgroup')) as fd:
+                match = RE_CONTAINER.search(fd.read())
+        except OSError:
+            match = None
+        if match:
+            # Short ID, as displayed by container managers.
+            return match.group()[:12]
+        return "net:%i" % inode
+
+    def sockets(self, pid):
+        """Inodes of the sockets opened by a process, in the order of its file descriptors."""
+        path = os.path.join(self.proc, str(pid), 'fd')
+        inodes = []
+        for fd in sorted(os.listdir(path), key=int):
+            try:
+                link = os.readlink(os.path.join(path, fd))
+            except OSError:
+                # Closed meanwhile.
+                continue
+            if link.startswith('socket:['):
+                inodes.append(link[8:-1])
+        return inodes
+
+    def table(self, pid):
+        """Return { inode : (family, local address, local port, remote address, remote port, status) }
+        for the TCP sockets of the namespace of a process."""
+        table = {}
+        for name, family in TABLES:
+            try:
+                fd = open(os.path.join(self.proc, str(pid), 'net', name))
+            except FileNotFoundError:
+                # No IPv6.
+                continue
+            with fd:
+                fd.readline()  # header
+                for line in fd:
+                    fields = line.split()
+                    laddr, lport = decode_address(fields[1], family)
+                    raddr, rport = decode_address(fields[2], family)
+                    table[fields[9]] = (family, laddr, lport, raddr, rport, TCP_STATES.get(fields[3], 'NONE'))
+        return table
+
+    def collect(self, tunnels, connections=True):
+        """Set the namespace of the tunnels and, if asked, their connections,
+        reading the sockets tables once per namespace.
+
+        The connections of the tunnels in other namespaces are always set,
+        as their health check needs them."""
+        # { namespace inode : [Tunnel] }
+        groups = {}
+        for t in tunnels.values():
+            try:
+                inode = self.namespace(t.ssh_pid)
+            except OSError:
+                # Gone, or not ours (not root).
+                logging.debug("Cannot read the network namespace of a tunnel")
+                continue
+            groups.setdefault(inode, []).append(t)
+
+        tags = {}
+        self.listening = {}
+        for inode, members in groups.items():
+            if inode in self.tags:
+                tags[inode] = self.tags[inode]
+            else:
+                tags[inode] = self.tag(inode, members[0].ssh_pid)
+            for t in members:
+                t.namespace = tags[inode]
+            if core.log_sensitive:
+                logging.debug("[SENSITIVE] namespace %i (%s): %i tunnels", inode, tags[inode], len(members))
+
+            if not connections and tags[inode] is None:
+                continue
+
+            table = None
+            for t in members:
+                try:
+                    inodes = self.sockets(t.ssh_pid)
+                    if table is None and inodes:
+                        # This process is the representative of its namespace.
+                        table = self.table(t.ssh_pid)
+                except OSError:
+                    continue
+                for sock in inodes:
+                    if sock in table:
+                        family, laddr, lport, raddr, rport, status = table[sock]
+                        t.connections.append(Connection(laddr, lport, raddr, rport, status, family))
+
+            if table is not None and tags[inode] is not None:
+                self.listening[tags[inode]] = {entry[2] for entry in table.values() if entry[5] == 'LISTEN'}
+
+        # Only remember the namespaces that are still used.
+        self.tags = tags
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# RECORD AND REPLAY
+#################################################################################################
+
+# A recording is a JSON Lines file, each line being one of:
+#   {"k":"f","t":TIME,"tunnels":{KEY:TUNNEL,...}}  a keyframe, holding all the tunnels,
+#   {"k":"d","t":TIME,"set":{KEY:TUNNEL,...},"del":[KEY,...]}  a delta from the previous line.
+# Deltas are only written when something changed. Tunnels hold absolute times,
+# so that a tunnel that does not change does not appear in deltas.
+# A keyframe is written at least every KEYFRAME_INTERVAL seconds, and each time a recorder starts,
+# so that replay can seek to any time by reading from the previous keyframe only.
+
+import bisect
+import json
+import mmap
+import os
+import socket
+import time
+
+from .core import TunnelsParser, AutoTunnel, SupervisedTunnel, RawTunnel, Connection, OPTIONAL_COLUMNS
+
+KEYFRAME_INTERVAL = 60  # seconds
+
+# Lines are written with this exact prefix, so that keyframes can be found without parsing JSON.
+KEYFRAME_PREFIX = b'{"k":"f","t":'
+
+FORWARDS = {'local': 'L', 'remote': 'R', 'dynamic': 'D'}
+
+
+def dumps(record):
+    return json.dumps(record, separators=(',', ':'))
+
+
+def since(timestamp, seconds):
+    """Absolute time of an event that happened some seconds before timestamp."""
+    if seconds is None:
+        return None
+    return round(timestamp - seconds, 2)
+
+
+def tunnel_to_dict(tunnel, timestamp):
+    if type(tunnel) == AutoTunnel:
+        kind, pid = 'auto', tunnel.autossh_pid
+    elif type(tunnel) == SupervisedTunnel:
+        kind, pid = 'super', tunnel.supervisor_pid
+    else:
+        kind, pid = 'ssh', tunnel.ssh_pid
+    return {
+        'type': kind,
+        'pid': pid,
+        'ssh_pid': tunnel.ssh_pid,
+        'forward': FORWARDS.get(tunnel.forward, '?'),
+        'in_port': tunnel.in_port,
+        'via_host': tunnel.via_host,
+        'target_host': tunnel.target_host,
+        'out_port': tunnel.out_port,
+        'started': since(timestamp, tunnel.uptime),
+        'restarts': tunnel.restarts,
+        'last_restart': since(timestamp, tunnel.last_restart),
+        'flaps': tunnel.flaps,
+        'health': tunnel.health,
+        'cpu': None if tunnel.cpu is None else round(tunnel.cpu, 1),
+        'rss': tunnel.rss,
+        'fds': tunnel.fds,
+        'ctx_switches': tunnel.ctx_switches,
+        'namespace': tunnel.namespace,
+        'connections': [[c.local_address, c.in_port, c.foreign_address, c.out_port, c.status, int(c.family)]
+                        for c in tunnel.connections],
+    }
+
+
+def dict_to_tunnel(d, timestamp):
+    args = (d['ssh_pid'], d['in_port'], d['via_host'], d['target_host'], d['out_port'], d['forward'])
+    if d['type'] == 'auto':
+        tunnel = AutoTunnel(d['pid'], *args)
+    elif d['type'] == 'super':
+        tunnel = SupervisedTunnel(d['pid'], *args)
+    else:
+        tunnel = RawTunnel(*args)
+    if d['started'] is not None:
+        tunnel.uptime = timestamp - d['started']
+    tunnel.restarts = d['restarts']
+    if d['last_restart'] is not None:
+        tunnel.last_restart = timestamp - d['last_restart']
+    tunnel.flaps = d['flaps']
+    tunnel.health = d['health']
+    # Recorded without resources accounting (or before it existed).
+    tunnel.cpu = d.get('cpu')
+    tunnel.rss = d.get('rss')
+    tunnel.fds = d.get('fds')
+    tunnel.ctx_switches = d.get('ctx_switches')
+    tunnel.namespace = d.get('namespace')
+    for laddr, lport, raddr, rport, status, family in d['connections']:
+        tunnel.connections.append(Connection(laddr, lport, raddr, rport, status, socket.AddressFamily(family)))
+    return tunnel
+
+
+class Recorder:
+    """Append the state of the tunnels to a recording file, at each update."""
+
+    def __init__(self, filename, keyframe_interval=KEYFRAME_INTERVAL):
+        self.fd = open(filename, 'a')
+        if self.fd.tell() > 0:
+            with open(filename, 'rb') as fd:
+                fd.seek(-1, os.SEEK_END)
+                truncated = fd.read(1) != b'\n'
+            if truncated:
+                # A previous recorder died while writing, do not append to its partial line.
+                self.fd.write("\n")
+        self.keyframe_interval = keyframe_interval
+        self.last_keyframe = None
+        # { key : tunnel dict } of the last record.
+        self.last = {}
+
+    def record(self, tp):
+        t = round(tp.timestamp, 3)
+        current = {str(k): tunnel_to_dict(tunnel, tp.timestamp) for k, tunnel in tp.tunnels.items()}
+
+        if self.last_keyframe is None or t - self.last_keyframe >= self.keyframe_interval:
+            self.fd.write(dumps({'k': 'f', 't': t, 'tunnels': current}) + "\n")
+            self.last_keyframe = t
+        else:
+            changed = {k: v for k, v in current.items() if self.last.get(k) != v}
+            deleted = [k for k in self.last if k not in current]
+            if not changed and not deleted:
+                return
+            self.fd.write(dumps({'k': 'd', 't': t, 'set': changed, 'del': deleted}) + "\n")
+        # Someone may be reading it.
+        self.fd.flush()
+        self.last = current
+
+    def close(self):
+        self.fd.close()
+
+
+class Recording:
+    """A memory-mapped recording file, with an index of its keyframes to seek in it quickly."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                raise ValueError("'%s' is an empty recording" % filename)
+            self.map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Sorted times and offsets of the keyframes.
+        self.times = []
+        self.offsets = []
+        offset = 0 if self.map[:len(KEYFRAME_PREFIX)] == KEYFRAME_PREFIX else self.map.find(b'\n' + KEYFRAME_PREFIX)
+        while offset != -1:
+            if self.map[offset:offset + 1] == b'\n':
+                offset += 1
+            start = offset + len(KEYFRAME_PREFIX)
+            try:
+                self.times.append(float(self.map[start:self.map.find(b',', start)]))
+            except ValueError:
+                # Partial line of a recorder that died.
+                pass
+            else:
+                self.offsets.append(offset)
+            offset = self.map.find(b'\n' + KEYFRAME_PREFIX, offset)
+        if not self.offsets:
+            raise ValueError("'%s' holds no keyframe" % filename)
+
+        self.start = self.times[0]
+        self.end = self.start
+        for offset, record in self.records(self.offsets[-1]):
+            self.end = record['t']
+
+    def keyframe(self, t):
+        """Offset of the last keyframe at or before time t (or of the first one)."""
+        i = bisect.bisect_right(self.times, t) - 1
+        return self.offsets[max(0, i)]
+
+    def records(self, offset):
+        """Yield (offset of the next record, record) from the given offset, up to the end of the file
+        or to an unterminated line. Bad lines (left by a recorder that died) are skipped."""
+        while offset < len(self.map):
+            end = self.map.find(b'\n', offset)
+            if end == -1:
+                return
+            line = self.map[offset:end]
+            offset = end + 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            yield offset, record
+
+    def close(self):
+        self.map.close()
+
+
+class ReplayParser(TunnelsParser):
+    """Give the tunnels from a recording instead of from the operating system.
+
+    Time flows from the start of the recording at the given speed, and can be paused and sought."""
+
+    def __init__(self, recording, speed=1.0, seek=0):
+        # Recordings hold every measure.
+        super().__init__(list(OPTIONAL_COLUMNS))
+        self.recording = recording
+        self.speed = speed
+        self.paused = False
+
+        # Time in the recording.
+        self.position = recording.start
+        # Wall clock time at which the position was last advanced.
+        self.wall = time.monotonic()
+
+        # { key : tunnel dict } at the position.
+        self.state = {}
+        # Offset and record that come next.
+        self.next_offset = None
+        self.next_record = None
+
+        self.seek(recording.start + seek)
+
+    def seek(self, t):
+        t = min(max(t, self.recording.start), self.recording.end)
+        self.state = {}
+        self.next_offset = self.recording.keyframe(t)
+        self.next_record = None
+        self.position = t
+        self.wall = time.monotonic()
+        self.forward()
+
+    def forward(self):
+        """Apply the records up to the position."""
+        records = self.recording.records(self.next_offset)
+        while True:
+            if self.next_record is None:
+                try:
+                    self.next_offset, self.next_record = next(records)
+                except StopIteration:
+                    return
+            record = self.next_record
+            if record['t'] > self.position:
+                return
+            if record['k'] == 'f':
+                self.state = record['tunnels']
+            else:
+                self.state.update(record['set'])
+                for k in record['del']:
+                    self.state.pop(k, None)
+            self.next_record = None
+
+    def update(self, connections=True):
+        now = time.monotonic()
+        if not self.paused:
+            self.position = min(self.position + (now - self.wall) * self.speed, self.recording.end)
+        self.wall = now
+        self.forward()
+
+        self.timestamp = self.position
+        self.tunnels.clear()
+        for k, d in self.state.items():
+            self.tunnels[int(k)] = dict_to_tunnel(d, self.position)
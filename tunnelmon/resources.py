@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# RESOURCES
+#################################################################################################
+
+# Resources used by the ssh process of each tunnel, read from /proc for the tunnels PIDs only,
+# once the tunnels have been found (it does not browse the processes table again).
+# The CPU usage is computed from the difference with the previous measure,
+# or averaged over the process lifetime the first time a process is seen.
+
+import logging
+import os
+import time
+
+
+class ResourceMeter:
+    """Measure CPU, memory, file descriptors and context switches of the tunnels ssh processes."""
+
+    def __init__(self, proc='/proc'):
+        self.proc = proc
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+        # { pid : (start time, CPU seconds, measure time) } of the last measure.
+        self.previous = {}
+
+    def read(self, pid):
+        """Return (start time in ticks, CPU seconds, RSS bytes, file descriptors, context switches) of a process,
+        the last two being None if they cannot be read (not root)."""
+        path = os.path.join(self.proc, str(pid))
+        with open(os.path.join(path, 'stat'), 'rb') as fd:
+            stat = fd.read()
+        # The command name may contain spaces and parenthesis.
+        fields = stat[stat.rindex(b')') + 2:].split()
+        # Fields 14 (utime), 15 (stime) and 22 (starttime) of proc(5), counted from 3 (state).
+        cpu = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        start = int(fields[19])
+
+        with open(os.path.join(path, 'statm'), 'rb') as fd:
+            rss = int(fd.read().split()[1]) * self.page_size
+
+        try:
+            fds = len(os.listdir(os.path.join(path, 'fd')))
+        except PermissionError:
+            fds = None
+
+        ctx = None
+        try:
+            with open(os.path.join(path, 'status'), 'rb') as fd:
+                for line in fd:
+                    if line.startswith((b'voluntary_ctxt_switches', b'nonvoluntary_ctxt_switches')):
+                        ctx = (ctx or 0) + int(line.split()[1])
+        except PermissionError:
+            pass
+
+        return start, cpu, rss, fds, ctx
+
+    def measure(self, tp):
+        """Set the resources used by all the tunnels of the parser."""
+        now = time.monotonic()
+        current = {}
+        for t in tp.tunnels.values():
+            try:
+                start, cpu, rss, fds, ctx = self.read(t.ssh_pid)
+            except (OSError, ValueError, IndexError):
+                # The process has gone.
+                logging.debug("Cannot read the resources of a tunnel")
+                continue
+            current[t.ssh_pid] = (start, cpu, now)
+
+            previous = self.previous.get(t.ssh_pid)
+            if previous and previous[0] == start and now > previous[2]:
+                t.cpu = 100 * (cpu - previous[1]) / (now - previous[2])
+            elif t.uptime:
+                t.cpu = 100 * cpu / t.uptime
+            else:
+                t.cpu = None
+            t.rss = rss
+            t.fds = fds
+            t.ctx_switches = ctx
+
+        # Only keep the processes of current tunnels.
+        self.previous = current
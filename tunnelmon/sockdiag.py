@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# SOCKET STATISTICS
+#################################################################################################
+
+# TCP statistics of the tunnels connections, asked to the kernel with a single sock_diag
+# (inet_diag) netlink dump per address family, instead of one query per socket.
+# This is Linux-only and does not need special privileges, but the kernel may refuse it,
+# in which case connections simply have no statistics.
+
+import logging
+import os
+import socket
+import struct
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+ALL_STATES = 0xffffffff
+
+# struct nlmsghdr
+NLMSGHDR = struct.Struct("=IHHII")
+# struct inet_diag_req_v2, followed by a zeroed struct inet_diag_sockid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")
+# struct inet_diag_msg: family, state, timer, retrans, sockid (sport, dport, src, dst, if, cookie),
+# expires, rqueue, wqueue, uid, inode; ports are in network byte order
+INET_DIAG_MSG = struct.Struct("=BBBBHH16s16sI8sIIIII")
+# struct rtattr
+RTATTR = struct.Struct("=HH")
+# The beginning of struct tcp_info, up to tcpi_total_retrans.
+TCP_INFO = struct.Struct("=8B24I")
+TCPI_RTT, TCPI_RTTVAR, TCPI_TOTAL_RETRANS = 23, 24, 31
+# tcpi_bytes_acked and tcpi_bytes_received, available since Linux 4.1 and 4.2.
+TCP_INFO_BYTES = struct.Struct("=QQ")
+TCP_INFO_BYTES_OFFSET = 120
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def unconnected_address(family):
+    """The foreign address of unconnected sockets, as given by inet_diag."""
+    return '0.0.0.0' if family == socket.AF_INET else '::'
+
+
+class TcpInfo:
+    """TCP statistics of a connection."""
+
+    def __init__(self, rqueue, wqueue, rtt, rttvar, retrans, bytes_acked=None, bytes_received=None):
+        self.rqueue = rqueue  # bytes in the receive queue
+        self.wqueue = wqueue  # bytes in the send queue
+        self.rtt = rtt  # smoothed round trip time, in microseconds
+        self.rttvar = rttvar  # round trip time variance, in microseconds
+        self.retrans = retrans  # total number of retransmitted segments
+        self.bytes_acked = bytes_acked  # None if the kernel is too old
+        self.bytes_received = bytes_received
+
+    def __repr__(self):
+        return "rtt=%.3fms\tretrans=%i\trecvq=%i\tsendq=%i\tacked=%s\treceived=%s" % (
+            self.rtt / 1000,
+            self.retrans,
+            self.rqueue,
+            self.wqueue,
+            "-" if self.bytes_acked is None else self.bytes_acked,
+            "-" if self.bytes_received is None else self.bytes_received)
+
+
+class SockDiag:
+    """Fetch the TCP statistics of all the tunnels connections at once, and join them to the connections."""
+
+    def __init__(self):
+        # Set to False as soon as the kernel refuses to answer, not to try again at each refresh.
+        self.available = hasattr(socket, 'AF_NETLINK')
+        self.seq = 0
+
+    def dump(self, family, wanted):
+        """Return { (local address, local port, foreign address, foreign port) : TcpInfo }
+        for the TCP sockets of the given family that are in the wanted set."""
+        stats = {}
+        self.seq += 1
+        req = INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), ALL_STATES)
+        msg = NLMSGHDR.pack(NLMSGHDR.size + len(req), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0) + req
+
+        addrlen = 4 if family == socket.AF_INET else 16
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as sock:
+            sock.sendall(msg)
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + NLMSGHDR.size <= len(data):
+                    length, kind, flags, seq, pid = NLMSGHDR.unpack_from(data, offset)
+                    if length < NLMSGHDR.size:
+                        done = True
+                        break
+                    body = offset + NLMSGHDR.size
+                    if kind == NLMSG_DONE:
+                        done = True
+                        break
+                    elif kind == NLMSG_ERROR:
+                        err, = struct.unpack_from("=i", data, body)
+                        if err:
+                            raise OSError(-err, "sock_diag: %s" % os.strerror(-err))
+                    elif kind == SOCK_DIAG_BY_FAMILY:
+                        self.parse(data, body, offset + length, addrlen, wanted, stats)
+                    offset += align(length)
+        return stats
+
+    def parse(self, data, start, end, addrlen, wanted, stats):
+        """Decode one inet_diag_msg, if it is one of the wanted sockets."""
+        (family, state, timer, retrans, sport, dport, src, dst, ifindex, cookie,
+         expires, rqueue, wqueue, uid, inode) = INET_DIAG_MSG.unpack_from(data, start)
+        key = (socket.inet_ntop(family, src[:addrlen]), socket.ntohs(sport),
+               socket.inet_ntop(family, dst[:addrlen]), socket.ntohs(dport))
+        if key not in wanted:
+            return
+
+        offset = start + INET_DIAG_MSG.size
+        while offset + RTATTR.size <= end:
+            length, kind = RTATTR.unpack_from(data, offset)
+            if length < RTATTR.size:
+                break
+            if kind == INET_DIAG_INFO and length - RTATTR.size >= TCP_INFO.size:
+                payload = offset + RTATTR.size
+                info = TCP_INFO.unpack_from(data, payload)
+                rtt, rttvar, total_retrans = info[TCPI_RTT], info[TCPI_RTTVAR], info[TCPI_TOTAL_RETRANS]
+                if length - RTATTR.size >= TCP_INFO_BYTES_OFFSET + TCP_INFO_BYTES.size:
+                    acked, received = TCP_INFO_BYTES.unpack_from(data, payload + TCP_INFO_BYTES_OFFSET)
+                else:
+                    acked, received = None, None
+                stats[key] = TcpInfo(rqueue, wqueue, rtt, rttvar, total_retrans, acked, received)
+                return
+            offset += align(length)
+
+    def collect(self, tp):
+        """Set the TCP statistics of the connections of all the tunnels, return False if they are not available."""
+        if not self.available:
+            return False
+
+        # { family : { key : [Connection] } }
+        wanted = {socket.AF_INET: {}, socket.AF_INET6: {}}
+        for t in tp.tunnels.values():
+            for c in t.connections:
+                c.tcp = None
+                # The netlink socket only sees the network namespace of Tunnelmon.
+                if c.family in wanted and t.namespace is None:
+                    key = (c.local_address, c.in_port, c.foreign_address or unconnected_address(c.family), c.out_port or 0)
+                    wanted[c.family].setdefault(key, []).append(c)
+
+        for family, conns in wanted.items():
+            if not conns:
+                continue
+            try:
+                stats = self.dump(family, conns)
+            except OSError as e:
+                logging.warning("Cannot get sockets statistics from the kernel: %s", e)
+                self.available = False
+                return False
+            for key, info in stats.items():
+                for c in conns[key]:
+                    c.tcp = info
+        return True
+
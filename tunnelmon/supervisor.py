@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+# Tunnelmon is an AutoSSH tunnel monitor
+# It gives a curses user interface to monitor existing SSH tunnel that are managed with autossh.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author : nojhan <nojhan@nojhan.net>
+#
+
+#################################################################################################
+# SUPERVISOR
+#################################################################################################
+
+# The supervisor starts the tunnels declared in the configuration file, and restarts them
+# when they exit, from a single event loop, instead of one autossh process per tunnel.
+# Tunnels are sections named "tunnel:<name>", for example:
+#
+#   [supervisor]
+#   ssh = ssh
+#   backoff_min = 1
+#   backoff_max = 300
+#   stable = 60
+#   alive_interval = 15
+#   alive_count = 3
+#
+#   [tunnel:db]
+#   forward = L
+#   in_port = 5432
+#   via_host = bastion
+#   target_host = db.internal
+#   out_port = 5432
+#   options = -i ~/.ssh/id_tunnel
+#
+# Each ssh is asked to check the server every "alive_interval" seconds and to exit after "alive_count"
+# unanswered checks (ServerAliveInterval/ServerAliveCountMax), and to exit if it cannot set up the forward
+# (ExitOnForwardFailure). A tunnel that exits is restarted after a delay, doubling at each consecutive failure
+# from "backoff_min" up to "backoff_max" seconds, with a random jitter, so that many tunnels to a host
+# that went down do not all come back at once. A tunnel that ran for "stable" seconds is considered
+# working again, and its delay is reset. Options of the [supervisor] section are defaults for the tunnels.
+#
+# Sending SIGUSR1 to the supervisor restarts all the tunnels; SIGTERM on an ssh process restarts it at once.
+
+import asyncio
+import logging
+import os
+import random
+import shlex
+import signal
+import sys
+
+from . import core
+
+DEFAULTS = {
+    'ssh': 'ssh',
+    'backoff_min': '1',
+    'backoff_max': '300',
+    'stable': '60',
+    'alive_interval': '15',
+    'alive_count': '3',
+    'options': '',
+}
+
+
+class SupervisedSsh:
+    """One tunnel of the supervisor: its ssh command, and the loop (re)starting it."""
+
+    def __init__(self, name, forward, in_port, via_host, target_host, out_port,
+                 ssh='ssh', options='', alive_interval=15, alive_count=3,
+                 backoff_min=1, backoff_max=300, stable=60):
+        if forward not in ('L', 'R'):
+            raise ValueError("only local (L) and remote (R) forwards can be supervised, not '%s'" % forward)
+        self.name = name
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.stable = stable
+
+        # Put the host last, where tunnelmon looks for it.
+        self.command = [ssh, '-N', '-T',
+                        '-o', 'BatchMode=yes',
+                        '-o', 'ExitOnForwardFailure=yes',
+                        '-o', 'ServerAliveInterval=%i' % alive_interval,
+                        '-o', 'ServerAliveCountMax=%i' % alive_count]
+        self.command += [os.path.expanduser(arg) for arg in shlex.split(options)]
+        self.command += ['-' + forward, '%i:%s:%i' % (in_port, target_host, out_port), via_host]
+
+        self.process = None
+        self.failures = 0  # consecutive
+        self.restarts = 0
+        self.last_error = None  # last line written by ssh on its standard error
+        self.stopping = False
+        self.restarting = False  # the running ssh has been terminated on purpose
+        self.wakeup = None
+
+    def delay(self):
+        """Jittered exponential backoff."""
+        if self.failures == 0:
+            return 0
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.5, 1)
+
+    def terminated(self, code):
+        """Whether ssh exited because of a SIGTERM sent from outside (e.g. by another Tunnelmon instance).
+        OpenSSH catches it, and says so before exiting with 255."""
+        return code == -signal.SIGTERM or self.last_error == "Killed by signal %i." % signal.SIGTERM
+
+    def exited(self, code, duration):
+        """Count the consecutive failures once ssh exited after running duration seconds,
+        return the delay before starting it again."""
+        if self.restarting or self.terminated(code):
+            # Asked for.
+            self.failures = 0
+        elif duration >= self.stable:
+            self.failures = 1
+        else:
+            self.failures += 1
+        self.restarting = False
+        return self.delay()
+
+    async def read_errors(self, fd):
+        """Read the standard error of ssh from the read end of its pipe, until the end of file."""
+        loop = asyncio.get_running_loop()
+        stream = asyncio.StreamReader()
+        transport, protocol = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stream),
+                                                           os.fdopen(fd, 'rb', 0))
+        try:
+            await self.read_lines(stream)
+        finally:
+            transport.close()
+
+    async def read_lines(self, stream):
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            self.last_error = line.decode(errors='replace').strip()
+            if core.log_sensitive:
+                logging.warning("[SENSITIVE] %s: ssh: %s", self.name, self.last_error)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        while not self.stopping:
+            # Restarts asked for from now on cut the backoff.
+            self.wakeup.clear()
+            self.last_error = None
+            started = loop.time()
+            # Processes started by ssh (like a ProxyCommand) may keep its standard error open after it exits,
+            # and asyncio would wait for them, if the pipe was its own.
+            errors, errors_in = os.pipe()
+            try:
+                self.process = await asyncio.create_subprocess_exec(
+                    *self.command,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=errors_in,
+                    start_new_session=True)  # not to get the signals of the terminal
+            except OSError as e:
+                logging.error("%s: cannot start ssh: %s", self.name, e)
+                os.close(errors)
+                code = None
+            else:
+                if core.log_sensitive:
+                    logging.debug("[SENSITIVE] %s: started ssh %i: %s", self.name, self.process.pid, self.command)
+                reader = asyncio.ensure_future(self.read_errors(errors))
+                code = await self.process.wait()
+                # Let the reader get the last words of ssh.
+                await asyncio.wait([reader], timeout=0.1)
+                reader.cancel()
+                # Stop what remains of its session.
+                try:
+                    os.killpg(self.process.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            finally:
+                os.close(errors_in)
+            self.process = None
+            if self.stopping:
+                break
+
+            self.restarts += 1
+            delay = self.exited(code, loop.time() - started)
+            if core.log_sensitive:
+                logging.warning("[SENSITIVE] %s: ssh exited (%s), restarting in %.1fs: %s", self.name, code, delay, self.last_error)
+            else:
+                logging.warning("%s: ssh exited (%s), restarting in %.1fs", self.name, code, delay)
+
+            if delay:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def restart(self):
+        """Restart at once."""
+        if self.wakeup:
+            # Cut the backoff, if waiting.
+            self.wakeup.set()
+        if self.process and self.process.returncode is None:
+            self.restarting = True
+            # ssh runs in its own session, stop its whole process group.
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def stop(self):
+        self.stopping = True
+        self.restart()
+
+
+class Supervisor:
+    """Run all the supervised tunnels in one asyncio event loop."""
+
+    def __init__(self, tunnels):
+        self.tunnels = tunnels
+        self.loop = None
+        self.done = None
+        self.stopping = False
+
+    @classmethod
+    def from_config(cls, config):
+        tunnels = []
+        defaults = dict(DEFAULTS)
+        # Do not interpolate, options may contain '%'.
+        if config.has_section('supervisor'):
+            defaults.update(config.items('supervisor', raw=True))
+        for section in config.sections():
+            if not section.startswith('tunnel:'):
+                continue
+            name = section[len('tunnel:'):].strip()
+            opts = dict(defaults)
+            opts.update(config.items(section, raw=True))
+            try:
+                tunnels.append(SupervisedSsh(
+                    name,
+                    opts['forward'].strip().upper(), int(opts['in_port']),
+                    opts['via_host'].strip(), opts['target_host'].strip(), int(opts['out_port']),
+                    os.path.expanduser(opts['ssh']), opts['options'],
+                    int(opts['alive_interval']), int(opts['alive_count']),
+                    float(opts['backoff_min']), float(opts['backoff_max']), float(opts['stable'])))
+            except KeyError as e:
+                logging.error("Invalid tunnel '%s': missing %s", name, e)
+            except ValueError as e:
+                logging.error("Invalid tunnel '%s': %s", name, e)
+        return cls(tunnels)
+
+    async def run(self):
+        self.done = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        if self.stopping:
+            # Stopped before being started.
+            return
+        # Do not spawn a thread per child to wait for it, where possible.
+        if sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher') and hasattr(os, 'pidfd_open'):
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(self.loop)
+            asyncio.set_child_watcher(watcher)
+        logging.debug("Supervising %i tunnels", len(self.tunnels))
+        tasks = [asyncio.ensure_future(t.run()) for t in self.tunnels]
+        await self.done.wait()
+        for t in self.tunnels:
+            t.stop()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error("Supervised tunnel failed: %r", result)
+
+    def restart(self, ssh_pid=None):
+        """Restart the tunnel whose ssh process has this PID, or all of them."""
+        if ssh_pid is None:
+            logging.warning("Restarting all tunnels")
+        for t in self.tunnels:
+            if ssh_pid is None or (t.process and t.process.pid == ssh_pid):
+                t.restart()
+
+    def stop(self):
+        self.stopping = True
+        if self.done:
+            self.done.set()
+
+    def threadsafe(self, func):
+        """Call a method from another thread."""
+        if self.loop:
+            self.loop.call_soon_threadsafe(func)
+        else:
+            func()
+
+    def serve(self):
+        """Run in the main thread, until SIGINT or SIGTERM."""
+        async def main():
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+            loop.add_signal_handler(signal.SIGTERM, self.stop)
+            loop.add_signal_handler(signal.SIGUSR1, self.restart)
+            await self.run()
+        asyncio.run(main())